@@ -0,0 +1,120 @@
+"""
+Image preprocessing applied before every embedding call.
+
+Phone photos arrive at full sensor resolution (often several MB), while the
+embedding model works on a much smaller image. prepare_for_embedding()
+applies the EXIF orientation, downscales to MAX_SIDE pixels on the long
+edge (using the JPEG decoder's draft mode, so large photos are never fully
+decoded) and re-encodes a compact RGB JPEG. Images that cannot be decoded
+are passed through unchanged for the model to judge.
+
+Bytes saved, preprocessing time and model-call time are accumulated in
+stats() so the effect is visible per instance.
+
+Each Cloud Function deploys its own source folder, so this module is kept
+identical in findProduct/, getProduct/, addProduct/ and
+addProductEmbedding/.
+"""
+
+import io
+import logging
+import os
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+# EMBED_IMAGE_PREPROCESS=0 sends original bytes (still measured), for A/B
+# comparison of model latency.
+ENABLED = os.environ.get("EMBED_IMAGE_PREPROCESS", "1") != "0"
+MAX_SIDE = int(os.environ.get("EMBED_IMAGE_MAX_SIDE", "512"))
+JPEG_QUALITY = int(os.environ.get("EMBED_IMAGE_JPEG_QUALITY", "90"))
+
+# Identifies the preprocessing output; part of every cache key derived from
+# raw image bytes so that changing the settings does not serve stale vectors.
+PREPROCESS_TAG = f"jpeg{MAX_SIDE}q{JPEG_QUALITY}" if ENABLED else "raw"
+
+_stats = {
+    "images": 0,
+    "passed_through": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "preprocess_seconds": 0.0,
+    "model_calls": 0,
+    "model_seconds": 0.0,
+    "model_bytes": 0
+}
+_stats_lock = threading.Lock()
+
+
+def _to_rgb(image):
+    """Flatten transparency onto white; JPEG has no alpha channel."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB') if image.mode != 'RGB' else image
+
+
+def prepare_for_embedding(image_bytes):
+    """Oriented, downscaled JPEG bytes for the embedding model (original bytes if undecodable)."""
+    start = time.perf_counter()
+    if not ENABLED:
+        _record(len(image_bytes), len(image_bytes), 0.0, passed_through=True)
+        return image_bytes
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        original_size = image.size
+        image.draft('RGB', (MAX_SIDE, MAX_SIDE))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+        image = _to_rgb(image)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=JPEG_QUALITY)
+        prepared = buffer.getvalue()
+    except Exception as e:
+        logging.warning(f"⚠ Image preprocessing skipped: {e}")
+        _record(len(image_bytes), len(image_bytes), time.perf_counter() - start, passed_through=True)
+        return image_bytes
+
+    elapsed = time.perf_counter() - start
+    _record(len(image_bytes), len(prepared), elapsed)
+    logging.info(
+        f"✓ Preprocessed image {original_size[0]}x{original_size[1]} → {image.size[0]}x{image.size[1]}: "
+        f"{len(image_bytes) / 1024:.0f}KB → {len(prepared) / 1024:.0f}KB in {elapsed * 1000:.0f}ms"
+    )
+    return prepared
+
+
+def _record(bytes_in, bytes_out, seconds, passed_through=False):
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["passed_through"] += passed_through
+        _stats["bytes_in"] += bytes_in
+        _stats["bytes_out"] += bytes_out
+        _stats["preprocess_seconds"] += seconds
+
+
+def record_model_call(seconds, sent_bytes):
+    """Called by the embed call sites so model latency can be compared with bytes sent."""
+    with _stats_lock:
+        _stats["model_calls"] += 1
+        _stats["model_seconds"] += seconds
+        _stats["model_bytes"] += sent_bytes
+
+
+def stats():
+    with _stats_lock:
+        s = dict(_stats)
+    images, calls = s["images"], s["model_calls"]
+    return {
+        "images": images,
+        "passed_through": s["passed_through"],
+        "bytes_saved": s["bytes_in"] - s["bytes_out"],
+        "avg_bytes_in": round(s["bytes_in"] / images) if images else None,
+        "avg_bytes_out": round(s["bytes_out"] / images) if images else None,
+        "avg_preprocess_ms": round(1000 * s["preprocess_seconds"] / images, 1) if images else None,
+        "avg_model_ms": round(1000 * s["model_seconds"] / calls, 1) if calls else None,
+        "avg_model_bytes": round(s["model_bytes"] / calls) if calls else None
+    }
@@ -1,31 +1,37 @@
 import functions_framework
-import firebase_admin
-from firebase_admin import auth, firestore
-import google.cloud.aiplatform as aiplatform
-from google.cloud.storage import Client as StorageClient
 
 from flask import request, jsonify
-import vertexai
-from vertexai.language_models import TextEmbeddingModel
-from vertexai.vision_models import Image, MultiModalEmbeddingModel
 from urllib.parse import urlparse
 
+import hashlib
+import logging
 import os
+import threading
+import time
 import uuid
+from collections import OrderedDict
+
+import image_preprocess
+import registry
+import timing
 
 # --- CONFIGURATION (populated by environment variables) ---
 GCP_PROJECT_ID = "storagedetective"
 GCP_REGION = "us-west1"
 VECTOR_SEARCH_ENDPOINT_ID = "782731332697456640"
 VECTOR_SEARCH_DEPLOYED_INDEX_ID = "v1"
+EMBEDDING_MODEL_NAME = "multimodalembedding"
+
+# Verified Firebase ID tokens kept per instance (LRU), each only until its own exp
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "1024"))
 
 # --- INITIALIZATION ---
-firebase_admin.initialize_app()
-aiplatform.init(project=GCP_PROJECT_ID, location=GCP_REGION)
-embedding_model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding")
-db = firestore.client()
-storage_client = StorageClient()
-index_endpoint = aiplatform.MatchingEngineIndexEndpoint(VECTOR_SEARCH_ENDPOINT_ID)
+logging.basicConfig(level=logging.INFO)
+
+# Firebase Admin and Vertex AI are imported and initialized on first use
+# (registry.firebase_app / registry.vertex_initialized), so cold starts and
+# OPTIONS preflights skip them.
+registry.configure_vertex(GCP_PROJECT_ID, GCP_REGION)
 
 # --- HELPER FUNCTIONS ---
 def get_image_bytes(gcs_uri: str) -> bytes:
@@ -33,55 +39,99 @@ def get_image_bytes(gcs_uri: str) -> bytes:
     parsed_url = urlparse(gcs_uri)
     bucket_name = parsed_url.netloc
     object_name = parsed_url.path.lstrip('/')
-    bucket = storage_client.get_bucket(bucket_name)
+    bucket = registry.storage_client().bucket(bucket_name)
     blob = bucket.blob(object_name)
     return blob.download_as_bytes()
 
+# Token hash -> decoded claims. verify_id_token runs without check_revoked,
+# so a cached result stays exactly as valid as a fresh verification until
+# the token's exp. Google's signing keys are cached (per their Cache-Control)
+# by the token verifier of the one Firebase app the registry keeps.
+_verified_tokens = OrderedDict()
+_verified_tokens_lock = threading.Lock()
+
+def verify_id_token_cached(id_token):
+    """Decoded claims of a Firebase ID token, verifying each distinct token once until it expires."""
+    key = hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+    with _verified_tokens_lock:
+        claims = _verified_tokens.get(key)
+        if claims is not None:
+            if claims.get('exp', 0) > time.time():
+                _verified_tokens.move_to_end(key)
+                return claims
+            del _verified_tokens[key]
+    
+    from firebase_admin import auth
+    claims = auth.verify_id_token(id_token, app=registry.firebase_app())
+    with _verified_tokens_lock:
+        _verified_tokens[key] = claims
+        while len(_verified_tokens) > TOKEN_CACHE_SIZE:
+            _verified_tokens.popitem(last=False)
+    return claims
+
 def get_user_from_token(request):
     """Verifies Firebase auth token from request header."""
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
         return None
     try:
-        return auth.verify_id_token(auth_header.split('Bearer ')[1])
+        return verify_id_token_cached(auth_header.split('Bearer ')[1])
     except Exception as e:
         print(f"Token verification failed: {e}")
         return None
 
 # --- CLOUD FUNCTIONS ---
 @functions_framework.http
+@timing.timed_handler("addProduct")
 def addProduct(request):
     if request.method == 'OPTIONS':
         headers = {'Access-Control-Allow-Origin': '*','Access-Control-Allow-Methods': 'POST','Access-Control-Allow-Headers': 'Content-Type, Authorization',}
         return ('', 204, headers)
-    headers = {'Access-Control-Allow-Origin': '*'}
+    headers = {'Access-Control-Allow-Origin': '*', 'Access-Control-Expose-Headers': 'Server-Timing'}
 
-    if not get_user_from_token(request):
+    with timing.span("auth"):
+        user = get_user_from_token(request)
+    if not user:
         return jsonify({"error": "Unauthorized"}), 403, headers
 
+    # Per-stage latency histograms of this instance
+    if request.method == 'GET' and timing.debug_requested(request):
+        return jsonify(timing.snapshot()), 200, headers
+
     data = request.get_json()
     if not all(k in data for k in ['productName', 'location', 'imageUrl']):
         return jsonify({"error": "Missing required fields"}), 400, headers
 
     try:
         product_id = str(uuid.uuid4())
-        image_bytes = get_image_bytes(data['imageUrl'])
+        with timing.span("download"):
+            image_bytes = get_image_bytes(data['imageUrl'])
         combined_text = f"Product: {data['productName']}, Description: {data.get('description', '')}"
 
         # 1. Generate Embedding (using new model logic)
+        from vertexai.vision_models import Image
+        with timing.span("preprocess"):
+            image_bytes = image_preprocess.prepare_for_embedding(image_bytes)
         image = Image(image_bytes)
-        embedding = embedding_model.get_embeddings(image=image, contextual_text=combined_text)
+        embedding_model = registry.embedding_model(EMBEDDING_MODEL_NAME)
+        start = time.perf_counter()
+        with timing.span("embedding"):
+            embedding = embedding_model.get_embeddings(image=image, contextual_text=combined_text)
+        image_preprocess.record_model_call(time.perf_counter() - start, len(image_bytes))
         vector_embedding = embedding.image_embedding # Use .image_embedding for the vector
 
         # 2. Save metadata to Firestore
-        product_ref = db.collection('products').document(product_id)
-        product_ref.set({'productName': data['productName'],'description': data.get('description', ''), 'location': data['location'],'imageUrl': data['imageUrl']})
+        product_ref = registry.firestore_client().collection('products').document(product_id)
+        with timing.span("firestore"):
+            product_ref.set({'productName': data['productName'],'description': data.get('description', ''), 'location': data['location'],'imageUrl': data['imageUrl']})
         
         # 3. Upsert embedding to Vector Search
-        index_endpoint.upsert_datapoints(
-            index_id=VECTOR_SEARCH_DEPLOYED_INDEX_ID,
-            datapoints=[{'datapoint_id': product_id, 'feature_vector': vector_embedding}]
-        )
+        index_endpoint = registry.matching_engine_index_endpoint(VECTOR_SEARCH_ENDPOINT_ID)
+        with timing.span("index_upsert"):
+            index_endpoint.upsert_datapoints(
+                index_id=VECTOR_SEARCH_DEPLOYED_INDEX_ID,
+                datapoints=[{'datapoint_id': product_id, 'feature_vector': vector_embedding}]
+            )
 
         return jsonify({"success": True, "productId": product_id}), 200, headers
     except Exception as e:
@@ -0,0 +1,139 @@
+"""
+Process-wide registry of Google Cloud clients and models.
+
+Every client is created once per instance on first use and then reused, so
+requests share gRPC channels / HTTP connection pools and the embedding model
+is resolved only once. Initialization time of each entry is recorded for
+cold-start diagnostics.
+
+The heavy SDKs (vertexai / google.cloud.aiplatform, firebase_admin) are only
+imported inside the factories, and their global initialization
+(vertexai.init, firebase_admin.initialize_app) runs on the first client that
+needs it, so importing a function's main and answering OPTIONS preflights
+costs none of it. Mains call configure_vertex() with their project/location
+at import time; that only records the settings.
+
+Each Cloud Function deploys its own source folder, so this module is kept
+identical in every function directory.
+"""
+
+import logging
+import threading
+import time
+
+_instances = {}
+_init_seconds = {}
+_key_locks = {}
+_registry_lock = threading.Lock()
+
+
+def get(key, factory):
+    """Return the instance registered under `key`, creating it with factory() once."""
+    instance = _instances.get(key)
+    if instance is not None:
+        return instance
+
+    with _registry_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Per-key lock: concurrent first callers wait for one initialization,
+    # without blocking unrelated clients.
+    with key_lock:
+        instance = _instances.get(key)
+        if instance is None:
+            start = time.perf_counter()
+            instance = factory()
+            elapsed = time.perf_counter() - start
+            _instances[key] = instance
+            _init_seconds[key] = elapsed
+            logging.info(f"✓ Initialized {key} in {elapsed:.3f}s")
+    return instance
+
+
+def init_timings():
+    """Seconds spent creating each registered client/model."""
+    return {key: round(seconds, 4) for key, seconds in _init_seconds.items()}
+
+
+# --- DEFERRED SDK INITIALIZATION ---
+_vertex_settings = {}
+
+
+def configure_vertex(project, location):
+    """Record the Vertex AI project/location; vertexai.init runs on first use."""
+    _vertex_settings.update(project=project, location=location)
+
+
+def vertex_initialized():
+    """vertexai.init once per instance (it also configures google.cloud.aiplatform)."""
+    def _create():
+        import vertexai
+        vertexai.init(**_vertex_settings)
+        return True
+    return get("vertexai.init", _create)
+
+
+def firebase_app():
+    """The default Firebase app, initialized on first use."""
+    def _create():
+        import firebase_admin
+        return firebase_admin.initialize_app()
+    return get("firebase_admin.App", _create)
+
+
+# --- CLIENT FACTORIES ---
+def storage_client():
+    def _create():
+        from google.cloud import storage
+        return storage.Client()
+    return get("storage.Client", _create)
+
+
+def embedding_model(model_name="multimodalembedding@001"):
+    def _create():
+        vertex_initialized()
+        from vertexai.vision_models import MultiModalEmbeddingModel
+        return MultiModalEmbeddingModel.from_pretrained(model_name)
+    return get(f"MultiModalEmbeddingModel:{model_name}", _create)
+
+
+def match_service_client(api_endpoint):
+    def _create():
+        from google.cloud import aiplatform_v1
+        return aiplatform_v1.MatchServiceClient(client_options={"api_endpoint": api_endpoint})
+    return get(f"MatchServiceClient:{api_endpoint}", _create)
+
+
+def matching_engine_index(index_name):
+    def _create():
+        vertex_initialized()
+        from google.cloud import aiplatform
+        return aiplatform.MatchingEngineIndex(index_name=index_name)
+    return get(f"MatchingEngineIndex:{index_name}", _create)
+
+
+def matching_engine_index_endpoint(endpoint_name):
+    def _create():
+        vertex_initialized()
+        from google.cloud import aiplatform
+        return aiplatform.MatchingEngineIndexEndpoint(endpoint_name)
+    return get(f"MatchingEngineIndexEndpoint:{endpoint_name}", _create)
+
+
+def http_session(pool_size=10):
+    """requests.Session with a connection pool sized for `pool_size` concurrent downloads."""
+    def _create():
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    return get(f"requests.Session:{pool_size}", _create)
+
+
+def firestore_client():
+    def _create():
+        from firebase_admin import firestore
+        return firestore.client(firebase_app())
+    return get("firestore.client", _create)
@@ -0,0 +1,218 @@
+"""
+Per-request stage timings.
+
+A handler wrapped with @timing.timed_handler("name") gets a RequestTimer for
+the duration of the call; code inside it marks stages with
+
+    with timing.span("embedding"):
+        ...
+
+When the handler returns, the stage durations are written as one structured
+(JSON) log line, attached to HTTP responses as a Server-Timing header, and
+added to in-process histograms that snapshot() returns for the
+?debug=timings view (off unless TIMING_DEBUG_ENDPOINT=1). Spans outside a timed request only feed the histograms. Work
+handed to a thread pool keeps the request's timer if submitted through
+timing.bind(fn).
+
+Each Cloud Function deploys its own source folder, so this module is kept
+identical in findProduct/, getProduct/, addProduct/ and addProductEmbedding/.
+"""
+
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in milliseconds; recent samples are kept for
+# exact percentiles.
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+RECENT_SAMPLES = 2048
+
+# Every N requests of a handler its histograms are also logged, which is the
+# only way to see them for event-triggered functions (0 disables).
+SUMMARY_EVERY = int(os.environ.get("TIMING_SUMMARY_EVERY", "100"))
+
+# The ?debug=timings view exposes instance internals, so it is opt-in.
+DEBUG_ENDPOINT = os.environ.get("TIMING_DEBUG_ENDPOINT", "0") == "1"
+
+_current = contextvars.ContextVar("request_timer", default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.recent.append(ms)
+
+    def summary(self):
+        recent = sorted(self.recent)
+
+        def percentile(p):
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))], 2) if recent else None
+
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(self.max_ms, 2),
+            "buckets_ms": {
+                (f"le_{bound}" if i < len(BUCKET_BOUNDS_MS) else "inf"): n
+                for i, (bound, n) in enumerate(zip(BUCKET_BOUNDS_MS + (None,), self.buckets)) if n
+            }
+        }
+
+
+_histograms = {}  # (request name, stage) -> Histogram
+_histograms_lock = threading.Lock()
+
+
+def record(request_name, stage, ms):
+    """Add a sample; returns the histogram's new count."""
+    with _histograms_lock:
+        histogram = _histograms.get((request_name, stage))
+        if histogram is None:
+            histogram = _histograms[(request_name, stage)] = Histogram()
+        histogram.add(ms)
+        return histogram.count
+
+
+def debug_requested(request):
+    """True if the request asks for ?debug=timings and the view is enabled."""
+    return DEBUG_ENDPOINT and request.args.get('debug') == 'timings'
+
+
+def snapshot():
+    """{request name: {stage: summary}} for everything recorded on this instance."""
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+        result = {}
+        for (request_name, stage), histogram in items:
+            result.setdefault(request_name, {})[stage] = histogram.summary()
+    return result
+
+
+class RequestTimer:
+    """Stage durations (ms, summed if a stage repeats) of one request, in first-seen order."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, ms):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self, total_ms):
+        parts = [f"{stage};dur={ms:.1f}" for stage, ms in self.stages.items()]
+        parts.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a block as `stage` of the current request; the request's totals
+    reach the histograms when it finishes. Outside a request the block is
+    recorded directly under "background".
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        timer = _current.get()
+        if timer is not None:
+            timer.add(stage, ms)
+        else:
+            record("background", stage, ms)
+
+
+def bind(fn):
+    """Wrap `fn` to run with the caller's request timer, e.g. pool.submit(timing.bind(fn), ...)."""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+def _status_of(result):
+    if isinstance(result, tuple) and len(result) >= 2 and isinstance(result[1], int):
+        return result[1]
+    return getattr(result, 'status_code', None)
+
+
+def _with_header(result, name, value):
+    """Add a header to a Flask-style handler result (tuple with headers dict, or Response)."""
+    if isinstance(result, tuple):
+        if len(result) == 3 and isinstance(result[2], dict):
+            result[2][name] = value
+            result[2].setdefault('Timing-Allow-Origin', '*')
+        elif len(result) == 2:
+            result = result + ({name: value, 'Timing-Allow-Origin': '*'},)
+    elif hasattr(result, 'headers'):
+        result.headers[name] = value
+        result.headers.setdefault('Timing-Allow-Origin', '*')
+    return result
+
+
+def _finish(timer, total_ms, result):
+    """Feed the histograms and write the request's structured log line."""
+    count = record(timer.name, "total", total_ms)
+    for stage, ms in timer.stages.items():
+        record(timer.name, stage, ms)
+    logging.info(json.dumps({
+        "severity": "INFO",
+        "message": f"timing {timer.name} {total_ms:.1f}ms",
+        "request": timer.name,
+        "status": _status_of(result),
+        "total_ms": round(total_ms, 2),
+        "stages_ms": {stage: round(ms, 2) for stage, ms in timer.stages.items()}
+    }))
+    if SUMMARY_EVERY and count % SUMMARY_EVERY == 0:
+        logging.info(json.dumps({
+            "severity": "INFO",
+            "message": f"timing summary {timer.name} after {count} requests",
+            "request": timer.name,
+            "histograms": snapshot().get(timer.name, {})
+        }))
+
+
+def timed_handler(name):
+    """Decorator for a Cloud Function entry point (HTTP or CloudEvent)."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            timer = RequestTimer(name)
+            token = _current.set(timer)
+            result = None
+            try:
+                result = handler(*args, **kwargs)
+            finally:
+                _current.reset(token)
+                total_ms = timer.total_ms()
+                _finish(timer, total_ms, result)
+            if result is not None:
+                result = _with_header(result, "Server-Timing", timer.server_timing(total_ms))
+            return result
+        return wrapper
+    return decorator
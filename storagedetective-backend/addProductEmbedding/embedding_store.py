@@ -0,0 +1,114 @@
+"""
+Content-addressed store of per-image embeddings.
+
+Each image embedding is saved once, keyed by the SHA-256 of the image bytes,
+as a float32 .npy object under
+    image_embeddings/<model>-<dimension>-<preprocessing>/<first two hex digits>/<sha256>.npy
+so re-embedding a product only calls the model for images whose content is
+new; unchanged photos reuse their stored vectors. Objects are immutable, so
+concurrent writers of the same image cannot conflict.
+
+Each Cloud Function deploys its own source folder, so this module is kept
+identical in getProduct/ and addProductEmbedding/.
+"""
+
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from google.api_core import exceptions as gcs_exceptions
+
+import image_preprocess
+import registry
+
+STORE_PREFIX = "image_embeddings/"
+MEMORY_ENTRIES = 1024
+
+
+def content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class EmbeddingStore:
+    """Per-image embeddings in GCS, fronted by a small in-process LRU."""
+
+    def __init__(self, bucket, model_name, dimension):
+        self.bucket = bucket
+        self.prefix = f"{STORE_PREFIX}{model_name.replace('@', '-')}-{dimension}-{image_preprocess.PREPROCESS_TAG}/"
+        self.dimension = dimension
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def blob_name(self, digest):
+        return f"{self.prefix}{digest[:2]}/{digest}.npy"
+
+    def get(self, digest):
+        """Stored embedding (list of floats) for an image hash, or None."""
+        with self._lock:
+            vector = self._memory.get(digest)
+            if vector is not None:
+                self._memory.move_to_end(digest)
+                self.hits += 1
+                return vector
+        try:
+            data = self.bucket.blob(self.blob_name(digest)).download_as_bytes()
+            array = np.load(io.BytesIO(data), allow_pickle=False)
+        except gcs_exceptions.NotFound:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logging.warning(f"⚠ Unreadable stored embedding {digest}: {e}")
+            self.misses += 1
+            return None
+        if array.shape != (self.dimension,):
+            self.misses += 1
+            return None
+        vector = array.tolist()
+        self._remember(digest, vector)
+        self.hits += 1
+        return vector
+
+    def put(self, digest, vector):
+        """
+        Store a fresh embedding. Returns it rounded to float32, exactly as later
+        reads will see it, so averages do not depend on whether a vector was cached.
+        """
+        array = np.asarray(vector, dtype=np.float32)
+        vector = array.tolist()
+        self._remember(digest, vector)
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        try:
+            self.bucket.blob(self.blob_name(digest)).upload_from_string(
+                buffer.getvalue(),
+                content_type='application/octet-stream',
+                if_generation_match=0
+            )
+        except gcs_exceptions.PreconditionFailed:
+            pass  # already stored by another writer - same content, same vector
+        except Exception as e:
+            logging.warning(f"⚠ Failed to store embedding {digest}: {e}")
+        return vector
+
+    def _remember(self, digest, vector):
+        with self._lock:
+            self._memory[digest] = vector
+            self._memory.move_to_end(digest)
+            while len(self._memory) > MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+
+def shared_store(bucket, model_name, dimension):
+    """One EmbeddingStore per bucket/model/dimension per instance, so the LRU is shared."""
+    return registry.get(
+        f"EmbeddingStore:{bucket.name}:{model_name}:{dimension}",
+        lambda: EmbeddingStore(bucket, model_name, dimension)
+    )
@@ -0,0 +1,81 @@
+"""
+Last-indexed state per product, for idempotent ingestion.
+
+Every write of a product JSON triggers add_product_embedding, including
+rewrites that only touch the title or catalog number and Eventarc
+redeliveries. A small marker object, index_state/<product_id>.json, records
+the fingerprint of the image URI list (plus model, dimension and
+preprocessing settings) that was last embedded and the event that did it,
+so unchanged images and duplicate events skip the model and index calls.
+
+Each Cloud Function deploys its own source folder, so this module is kept
+identical in getProduct/ and addProductEmbedding/.
+"""
+
+import hashlib
+import json
+import logging
+import time
+
+from google.api_core import exceptions as gcs_exceptions
+
+import image_preprocess
+
+STATE_PREFIX = "index_state/"
+
+
+def marker_name(product_id):
+    return f"{STATE_PREFIX}{product_id}.json"
+
+
+def fingerprint(image_uris, model_name, dimension):
+    """Stable hash of what the product's vector is computed from."""
+    payload = json.dumps({
+        'images': list(image_uris),
+        'model': model_name,
+        'dimension': dimension,
+        'preprocess': image_preprocess.PREPROCESS_TAG
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def embedded_uris(image_uris, failures):
+    """The URIs that made it into the vector: all but image_pipeline.embed_images() failures."""
+    failed = {index for index, _, _ in failures}
+    return [uri for i, uri in enumerate(image_uris) if i not in failed]
+
+
+def read_marker(bucket, product_id):
+    """The stored marker dict, or None if the product was never indexed (or it is unreadable)."""
+    try:
+        return json.loads(bucket.blob(marker_name(product_id)).download_as_bytes())
+    except gcs_exceptions.NotFound:
+        return None
+    except Exception as e:
+        logging.warning(f"⚠ Unreadable index state for {product_id}: {e}")
+        return None
+
+
+def write_marker(bucket, product_id, product_fingerprint, event_id=None, source_generation=None):
+    marker = {
+        'fingerprint': product_fingerprint,
+        'event_id': event_id,
+        'source_generation': source_generation,
+        'indexed_at': time.time()
+    }
+    try:
+        bucket.blob(marker_name(product_id)).upload_from_string(
+            json.dumps(marker), content_type='application/json'
+        )
+    except Exception as e:
+        logging.warning(f"⚠ Failed to record index state for {product_id}: {e}")
+    return marker
+
+
+def delete_marker(bucket, product_id):
+    try:
+        bucket.blob(marker_name(product_id)).delete()
+    except gcs_exceptions.NotFound:
+        pass
+    except Exception as e:
+        logging.warning(f"⚠ Failed to delete index state for {product_id}: {e}")
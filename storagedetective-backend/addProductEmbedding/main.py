@@ -1,14 +1,37 @@
+"""
+Keeps Vector Search, the catalog snapshot and the persisted vector index in
+step with the product JSONs under json/ in the metadata bucket.
+
+The same entry point is deployed twice from this folder, because an Eventarc
+trigger matches one event type (run ../check_shared_modules.py first, so the
+copied helper modules match the other functions):
+
+    gcloud functions deploy add_product_embedding --gen2 --source=. \
+        --entry-point=add_product_embedding \
+        --trigger-event-filters="type=google.cloud.storage.object.v1.finalized" \
+        --trigger-event-filters="bucket=storagedetective.firebasestorage.app"
+    gcloud functions deploy remove_product_embedding --gen2 --source=. \
+        --entry-point=add_product_embedding \
+        --trigger-event-filters="type=google.cloud.storage.object.v1.deleted" \
+        --trigger-event-filters="bucket=storagedetective.firebasestorage.app"
+
+Without the deleted trigger, product JSON removed outside get_products stays
+in the snapshot and the vector indexes.
+"""
+
 import json
 import logging
 import functions_framework
-import vertexai
-from vertexai.vision_models import MultiModalEmbeddingModel, Image as VertexImage
-from google.cloud import aiplatform
-from google.cloud import storage
-import requests
-import numpy as np
 from cloudevents.http import CloudEvent
 
+import catalog
+import embedding_store
+import image_pipeline
+import ingest_state
+import registry
+import timing
+import vector_index
+
 logging.basicConfig(level=logging.INFO)
 
 # Configuration
@@ -16,14 +39,18 @@ PROJECT_ID = "storagedetective"
 PROJECT_NUMBER = "325488595361"
 LOCATION = "us-central1"
 EMBEDDING_DIMENSION = 512
+EMBEDDING_MODEL_NAME = "multimodalembedding@001"
+IMAGE_DOWNLOAD_TIMEOUT_SECONDS = 10
 
 INDEX_ID = "8707413011381354496"
 INDEX_NAME = f"projects/{PROJECT_NUMBER}/locations/{LOCATION}/indexes/{INDEX_ID}"
 
-aiplatform.init(project=PROJECT_ID, location=LOCATION)
+# Vertex AI is initialized on first embedding/index call, not at cold start
+registry.configure_vertex(PROJECT_ID, LOCATION)
 
 
 @functions_framework.cloud_event
+@timing.timed_handler("add_product_embedding")
 def add_product_embedding(cloud_event: CloudEvent):
     """
     Triggered when JSON is uploaded.
@@ -57,12 +84,42 @@ def add_product_embedding(cloud_event: CloudEvent):
     if not file_name.startswith("json/") or not file_name.endswith(".json"):
         return
     
+    storage_client = registry.storage_client()
+    bucket = storage_client.bucket(bucket_name)
+    
+    if cloud_event["type"].endswith(".deleted"):
+        # Overwrites also emit a delete event for the replaced generation
+        if bucket.get_blob(file_name) is not None:
+            logging.info(f"Ignoring delete of an overwritten generation: {file_name}")
+            return
+        product_id = file_name[len("json/"):-len(".json")]
+        try:
+            with timing.span("snapshot"):
+                catalog.update_snapshot(bucket, removed_names=[file_name])
+            logging.info(f"✓ Removed from catalog snapshot: {file_name}")
+        except Exception as e:
+            logging.error(f"Failed to update catalog snapshot: {e}", exc_info=True)
+        # get_products removes its own deletes already; repeating it is harmless
+        try:
+            with timing.span("index_remove"):
+                registry.matching_engine_index(INDEX_NAME).remove_datapoints(datapoint_ids=[product_id])
+            logging.info(f"✓ Removed from index: {product_id}")
+        except Exception as e:
+            logging.warning(f"⚠ Index removal failed: {e}")
+        try:
+            with timing.span("vector_index"):
+                vector_index.update_persisted_index(bucket, removals=[product_id])
+        except Exception as e:
+            logging.warning(f"⚠ Local vector index update failed: {e}")
+        # A re-created product must be embedded again
+        ingest_state.delete_marker(bucket, product_id)
+        return
+    
     try:
         # Read JSON
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(file_name)
-        json_string = blob.download_as_string()
+        with timing.span("read_json"):
+            json_string = blob.download_as_string()
         json_data = json.loads(json_string)
         
         # Extract product
@@ -76,6 +133,21 @@ def add_product_embedding(cloud_event: CloudEvent):
         if not product_id:
             return
         
+        # Eventarc redelivery of an event (or object version) already handled
+        event_id = cloud_event["id"]
+        with timing.span("index_state"):
+            marker = ingest_state.read_marker(bucket, product_id)
+        if marker and (marker.get('event_id') == event_id or marker.get('source_generation') == blob.generation):
+            logging.info(f"✓ Duplicate event {event_id} for {product_id} - already processed")
+            return
+        
+        # Keep the catalog snapshot in step with the written JSON
+        try:
+            with timing.span("snapshot"):
+                catalog.update_snapshot(bucket, upserts=[catalog.make_entry(file_name, blob.generation, json_data)])
+        except Exception as e:
+            logging.warning(f"⚠ Catalog snapshot update failed: {e}")
+        
         # Get ALL image URIs
         image_uris = []
         if 'images' in product and isinstance(product['images'], list):
@@ -93,56 +165,59 @@ def add_product_embedding(cloud_event: CloudEvent):
             logging.warning(f"No images found for product: {product_id}")
             return
         
+        # Metadata-only rewrites (title, catalogNumber, ...) keep the same vector
+        product_fingerprint = ingest_state.fingerprint(image_uris, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION)
+        if marker and marker.get('fingerprint') == product_fingerprint:
+            logging.info(f"✓ Images unchanged for {product_id} - skipping embedding")
+            ingest_state.write_marker(bucket, product_id, product_fingerprint, event_id, blob.generation)
+            return
+        
         logging.info(f"Processing {len(image_uris)} image(s) for: {product.get('title', 'Unknown')}")
         
-        # Initialize model
-        vertexai.init(project=PROJECT_ID, location=LOCATION)
-        model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
-        
-        # Generate embedding for EACH image
-        all_embeddings = []
-        for i, image_uri in enumerate(image_uris):
-            try:
-                logging.info(f"  → Processing image {i+1}/{len(image_uris)}")
-                image_bytes = requests.get(image_uri, timeout=10).content
-                image = VertexImage(image_bytes=image_bytes)
-                
-                embeddings = model.get_embeddings(
-                    image=image,
-                    contextual_text=None,  # IMAGE ONLY
-                    dimension=EMBEDDING_DIMENSION
-                )
-                
-                all_embeddings.append(embeddings.image_embedding)
-                logging.info(f"  ✓ Generated embedding for image {i+1}")
-                
-            except Exception as e:
-                logging.error(f"  ✗ Failed to process image {i+1}: {e}")
-                continue
+        model = registry.embedding_model(EMBEDDING_MODEL_NAME)
+        
+        # Download + embed every image concurrently, then AVERAGE into one
+        # (unchanged photos reuse their stored per-image embeddings)
+        store = embedding_store.shared_store(bucket, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION)
+        with timing.span("embedding"):
+            all_embeddings, failures = image_pipeline.embed_images(
+                model, image_uris, EMBEDDING_DIMENSION, timeout=IMAGE_DOWNLOAD_TIMEOUT_SECONDS, store=store
+            )
         
         if not all_embeddings:
             logging.error(f"Failed to generate any embeddings for: {product_id}")
             return
         
-        # AVERAGE all embeddings into one
-        if len(all_embeddings) == 1:
-            final_embedding = all_embeddings[0]
-            logging.info(f"Using single embedding")
-        else:
-            embedding_array = np.array(all_embeddings)
-            final_embedding = np.mean(embedding_array, axis=0).tolist()
+        final_embedding = image_pipeline.average_embeddings(all_embeddings)
+        if len(all_embeddings) > 1:
             logging.info(f"✓ Averaged {len(all_embeddings)} embeddings into one")
         
         logging.info(f"Final embedding dimension: {len(final_embedding)}")
         
         # Upsert to index
-        my_index = aiplatform.MatchingEngineIndex(index_name=INDEX_NAME)
-        my_index.upsert_datapoints(datapoints=[{
-            "datapoint_id": product_id,
-            "feature_vector": final_embedding
-        }])
-        
-        logging.info(f"✓✓✓ Indexed: {product.get('title', 'Unknown')} with {len(image_uris)} image(s)")
+        my_index = registry.matching_engine_index(INDEX_NAME)
+        with timing.span("index_upsert"):
+            my_index.upsert_datapoints(datapoints=[{
+                "datapoint_id": product_id,
+                "feature_vector": final_embedding
+            }])
+        
+        logging.info(f"✓✓✓ Indexed: {product.get('title', 'Unknown')} with {len(all_embeddings)}/{len(image_uris)} image(s)")
+        
+        try:
+            with timing.span("vector_index"):
+                vector_index.update_persisted_index(bucket, upserts={product_id: final_embedding})
+        except Exception as e:
+            logging.warning(f"⚠ Local vector index update failed: {e}")
+        
+        if failures:
+            # Record only the images that made it in (and no event), so the
+            # next event or redelivery for this JSON retries the rest
+            ingest_state.write_marker(bucket, product_id, ingest_state.fingerprint(
+                ingest_state.embedded_uris(image_uris, failures), EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION
+            ))
+        else:
+            ingest_state.write_marker(bucket, product_id, product_fingerprint, event_id, blob.generation)
         
     except Exception as e:
         logging.error(f"Failed: {e}", exc_info=True)
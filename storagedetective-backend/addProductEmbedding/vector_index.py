@@ -0,0 +1,428 @@
+"""
+In-process vector index mirroring the Vertex AI Vector Search index.
+
+ExactIndex keeps every product embedding in one float32 matrix and answers
+dot-product top-k queries with a single matmul + argpartition. IVFIndex adds
+an inverted-file layer (k-means centroids; a query scans only the `nprobe`
+closest lists) for catalogs too large for a full scan.
+
+Persistence is a base snapshot plus a delta log in the metadata bucket. The
+base (catalog/vectors.npz) is written only by find_product, when it
+bootstraps or compacts the index. The ingest paths (add_product_embedding,
+get_products, the reindex command) never rewrite it: each update is a small
+delta object under catalog/vectors-delta/ named by write time. find_product
+loads the base, replays the deltas newer than the base's `applied_through`
+mark in name order, picks up new deltas on refresh, and folds settled
+deltas back into the base once DELTA_COMPACT_THRESHOLD have accumulated.
+Replaying a delta that the base already contains is harmless, because
+upserts and removals are idempotent when applied in order.
+
+Each Cloud Function deploys its own source folder, so this module is kept
+identical in findProduct/, getProduct/ and addProductEmbedding/.
+"""
+
+import io
+import logging
+import math
+import threading
+import time
+import uuid
+
+import numpy as np
+from google.api_core import exceptions as gcs_exceptions
+
+INDEX_BLOB = "catalog/vectors.npz"
+DELTA_PREFIX = "catalog/vectors-delta/"
+DEFAULT_DIMENSION = 512
+
+# Compaction folds deltas into the base once this many are pending, but only
+# deltas older than DELTA_SETTLE_SECONDS: a writer's name is taken before its
+# upload finishes, so a newer-looking delta may still appear below a fresh one.
+DELTA_COMPACT_THRESHOLD = 200
+DELTA_SETTLE_SECONDS = 120
+
+IVF_MIN_TRAIN_SIZE = 1024
+IVF_KMEANS_ITERATIONS = 10
+IVF_KMEANS_SAMPLE = 50000
+IVF_DEFAULT_NPROBE = 8
+
+
+class ExactIndex:
+    """Brute-force dot-product index over a growable float32 matrix."""
+
+    kind = "exact"
+
+    def __init__(self, dimension=DEFAULT_DIMENSION, capacity=1024):
+        self.dimension = dimension
+        self.ids = []
+        self._rows = {}
+        self._vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self._lock = threading.RLock()
+        # Newest delta name folded into this index when it was persisted as the base
+        self.applied_through = ""
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, datapoint_id):
+        return datapoint_id in self._rows
+
+    @property
+    def vectors(self):
+        """View of the occupied rows (row i belongs to ids[i])."""
+        return self._vectors[:len(self.ids)]
+
+    def _as_vector(self, vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-d vector, got {vector.shape[0]}")
+        return vector
+
+    def upsert(self, datapoint_id, vector):
+        vector = self._as_vector(vector)
+        with self._lock:
+            row = self._rows.get(datapoint_id)
+            if row is None:
+                row = len(self.ids)
+                if row == self._vectors.shape[0]:
+                    grown = np.zeros((max(1, row) * 2, self.dimension), dtype=np.float32)
+                    grown[:row] = self._vectors[:row]
+                    self._vectors = grown
+                self.ids.append(datapoint_id)
+                self._rows[datapoint_id] = row
+            self._vectors[row] = vector
+
+    def remove(self, datapoint_id):
+        """Delete a datapoint by moving the last row into its slot. Returns True if present."""
+        with self._lock:
+            row = self._rows.pop(datapoint_id, None)
+            if row is None:
+                return False
+            last = len(self.ids) - 1
+            if row != last:
+                moved_id = self.ids[last]
+                self._vectors[row] = self._vectors[last]
+                self.ids[row] = moved_id
+                self._rows[moved_id] = row
+            self.ids.pop()
+            return True
+
+    def get_vector(self, datapoint_id):
+        row = self._rows.get(datapoint_id)
+        return None if row is None else self._vectors[row].copy()
+
+    def search(self, query, k):
+        """Top-k (id, dot product) pairs, best first; ties broken by id for determinism."""
+        query = self._as_vector(query)
+        with self._lock:
+            count = len(self.ids)
+            if count == 0 or k <= 0:
+                return []
+            scores = self._vectors[:count] @ query
+            return self._rank(np.arange(count), scores, k)
+
+    def _rank(self, rows, scores, k):
+        """Top-k of `rows` by `scores` (aligned arrays) as (id, score) pairs."""
+        if len(rows) == 0 or k <= 0:
+            return []
+        if k < len(rows):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(rows))
+        ids = self.ids
+        ranked = sorted(top.tolist(), key=lambda i: (-scores[i], ids[rows[i]]))
+        return [(ids[rows[i]], float(scores[i])) for i in ranked]
+
+    # --- SERIALIZATION ---
+    def _arrays(self):
+        return {
+            'kind': np.array(self.kind),
+            'ids': np.array(self.ids, dtype=str),
+            'vectors': self.vectors,
+            'applied_through': np.array(self.applied_through)
+        }
+
+    def to_bytes(self):
+        with self._lock:
+            buffer = io.BytesIO()
+            np.savez(buffer, **self._arrays())
+            return buffer.getvalue()
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        vectors = arrays['vectors'].astype(np.float32, copy=False)
+        dimension = vectors.shape[1] if vectors.ndim == 2 and vectors.shape[1] else DEFAULT_DIMENSION
+        ids = arrays['ids'].tolist()
+        index = cls(dimension=dimension, capacity=max(1024, len(ids)))
+        index._vectors[:len(ids)] = vectors
+        index.ids = ids
+        index._rows = {datapoint_id: row for row, datapoint_id in enumerate(ids)}
+        if 'applied_through' in arrays:
+            index.applied_through = str(arrays['applied_through'])
+        return index
+
+
+class IVFIndex(ExactIndex):
+    """
+    IVF-flat approximate index. Vectors are assigned to the closest of
+    `nlist` k-means centroids; a query scores only rows whose list is among
+    the `nprobe` centroids closest to it. Inserts and deletes are incremental;
+    retrain() once the catalog has grown well past the trained size.
+    Untrained (or small) indexes answer exactly.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, dimension=DEFAULT_DIMENSION, capacity=1024, nprobe=IVF_DEFAULT_NPROBE):
+        super().__init__(dimension, capacity)
+        self.nprobe = nprobe
+        self.centroids = None
+        self.trained_size = 0
+        self._lists = np.full(capacity, -1, dtype=np.int32)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def needs_training(self):
+        count = len(self.ids)
+        if not self.trained:
+            return count >= IVF_MIN_TRAIN_SIZE
+        return count >= 2 * self.trained_size
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def train(self, nlist=None, seed=0):
+        """Run spherical k-means over (a sample of) the current vectors and reassign every row."""
+        with self._lock:
+            count = len(self.ids)
+            if count == 0:
+                return
+            nlist = nlist or max(1, min(count, int(4 * math.sqrt(count))))
+            rng = np.random.default_rng(seed)
+            data = self.vectors
+            if count > IVF_KMEANS_SAMPLE:
+                data = data[rng.choice(count, IVF_KMEANS_SAMPLE, replace=False)]
+
+            centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+            for _ in range(IVF_KMEANS_ITERATIONS):
+                labels = np.argmax(data @ centroids.T, axis=1)
+                counts = np.bincount(labels, minlength=nlist)
+                nonempty = np.flatnonzero(counts)
+                starts = (np.cumsum(counts) - counts)[nonempty]
+                sums = np.add.reduceat(data[np.argsort(labels, kind='stable')], starts, axis=0)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                norms[norms == 0] = 1
+                centroids[nonempty] = sums / norms
+
+            self.centroids = centroids.astype(np.float32)
+            self.trained_size = count
+            self._lists = np.full(self._vectors.shape[0], -1, dtype=np.int32)
+            self._lists[:count] = self._assign(self.vectors)
+
+    def upsert(self, datapoint_id, vector):
+        with self._lock:
+            super().upsert(datapoint_id, vector)
+            row = self._rows[datapoint_id]
+            if row >= len(self._lists):
+                grown = np.full(self._vectors.shape[0], -1, dtype=np.int32)
+                grown[:len(self._lists)] = self._lists
+                self._lists = grown
+            if self.trained:
+                self._lists[row] = self._assign(self._vectors[row:row + 1])[0]
+
+    def remove(self, datapoint_id):
+        with self._lock:
+            row = self._rows.get(datapoint_id)
+            if row is None:
+                return False
+            last = len(self.ids) - 1
+            self._lists[row] = self._lists[last]
+            self._lists[last] = -1
+            return super().remove(datapoint_id)
+
+    def search(self, query, k):
+        if not self.trained:
+            return super().search(query, k)
+        query = self._as_vector(query)
+        with self._lock:
+            count = len(self.ids)
+            if count == 0 or k <= 0:
+                return []
+            centroid_scores = self.centroids @ query
+            nprobe = min(self.nprobe, len(self.centroids))
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+            rows = np.flatnonzero(np.isin(self._lists[:count], probes))
+            scores = self._vectors[rows] @ query
+            return self._rank(rows, scores, k)
+
+    def _arrays(self):
+        arrays = super()._arrays()
+        arrays['nprobe'] = np.array(self.nprobe)
+        arrays['trained_size'] = np.array(self.trained_size)
+        if self.trained:
+            arrays['centroids'] = self.centroids
+            arrays['lists'] = self._lists[:len(self.ids)]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = super().from_arrays(arrays)
+        count = len(index.ids)
+        index._lists = np.full(index._vectors.shape[0], -1, dtype=np.int32)
+        if 'nprobe' in arrays:
+            index.nprobe = int(arrays['nprobe'])
+        if 'centroids' in arrays:
+            index.centroids = arrays['centroids'].astype(np.float32)
+            index.trained_size = int(arrays['trained_size'])
+            index._lists[:count] = arrays['lists']
+        return index
+
+    @classmethod
+    def from_index(cls, source, nprobe=IVF_DEFAULT_NPROBE):
+        """Copy another index's vectors into an IVF index and train it if large enough."""
+        index = cls.from_arrays(source._arrays())
+        index.nprobe = nprobe
+        if index.needs_training():
+            index.train()
+        return index
+
+
+INDEX_KINDS = {ExactIndex.kind: ExactIndex, IVFIndex.kind: IVFIndex}
+
+
+def index_from_bytes(data):
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        kind = str(arrays['kind']) if 'kind' in arrays else ExactIndex.kind
+        return INDEX_KINDS[kind].from_arrays(arrays)
+
+
+# --- GCS PERSISTENCE ---
+def read_index(bucket):
+    """Return (index, generation) from the persisted object, or (None, 0) if absent."""
+    blob = bucket.blob(INDEX_BLOB)
+    try:
+        data = blob.download_as_bytes()
+    except gcs_exceptions.NotFound:
+        return None, 0
+    return index_from_bytes(data), blob.generation
+
+
+def index_generation(bucket):
+    """Current generation of the persisted index (metadata call only), 0 if absent."""
+    blob = bucket.get_blob(INDEX_BLOB)
+    return blob.generation if blob else 0
+
+
+def write_index(bucket, index, if_generation_match=None):
+    blob = bucket.blob(INDEX_BLOB)
+    blob.upload_from_string(
+        index.to_bytes(),
+        content_type='application/octet-stream',
+        if_generation_match=if_generation_match
+    )
+    return blob.generation
+
+
+# --- DELTA LOG ---
+def _new_delta_name():
+    return f"{DELTA_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.npz"
+
+
+def _delta_time(name):
+    """Write time (seconds) encoded in a delta object name."""
+    return int(name[len(DELTA_PREFIX):].split('-', 1)[0]) / 1e9
+
+
+def update_persisted_index(bucket, upserts=None, removals=()):
+    """
+    Record {datapoint_id: vector} upserts and id removals as one delta object
+    (no read-modify-write of the base, so concurrent writers never conflict).
+    Does nothing if no base exists yet - find_product bootstraps the full
+    index from Vector Search. Returns True if a delta was written.
+    """
+    upserts = upserts or {}
+    if not upserts and not removals:
+        return False
+    if bucket.get_blob(INDEX_BLOB) is None:
+        return False
+    
+    ids = list(upserts)
+    vectors = (
+        np.stack([np.asarray(upserts[i], dtype=np.float32).reshape(-1) for i in ids])
+        if ids else np.zeros((0, DEFAULT_DIMENSION), dtype=np.float32)
+    )
+    buffer = io.BytesIO()
+    np.savez(buffer, upsert_ids=np.array(ids, dtype=str), vectors=vectors,
+             remove_ids=np.array(list(removals), dtype=str))
+    name = _new_delta_name()
+    bucket.blob(name).upload_from_string(buffer.getvalue(), content_type='application/octet-stream')
+    logging.info(f"✓ Vector index delta {name}: {len(ids)} upsert(s), {len(removals)} removal(s)")
+    return True
+
+
+def list_deltas(bucket, after=""):
+    """Delta object names newer than `after`, oldest first."""
+    blobs = bucket.list_blobs(prefix=DELTA_PREFIX, fields="items(name),nextPageToken")
+    return sorted(blob.name for blob in blobs if blob.name.endswith('.npz') and blob.name > after)
+
+
+def apply_deltas(bucket, index, applied):
+    """
+    Replay, in name order, the deltas newer than index.applied_through that
+    are not in `applied` (a set of delta names, updated in place). Returns
+    the number applied; deltas that vanish mid-way (compacted) are skipped.
+    """
+    count = 0
+    for name in list_deltas(bucket, index.applied_through):
+        if name in applied:
+            continue
+        try:
+            data = bucket.blob(name).download_as_bytes()
+        except gcs_exceptions.NotFound:
+            continue
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            for datapoint_id in arrays['remove_ids'].tolist():
+                index.remove(datapoint_id)
+            for datapoint_id, vector in zip(arrays['upsert_ids'].tolist(), arrays['vectors']):
+                index.upsert(datapoint_id, vector)
+        applied.add(name)
+        count += 1
+    return count
+
+
+def compact(bucket, index, generation, applied):
+    """
+    If DELTA_COMPACT_THRESHOLD deltas are pending, persist `index` (which has
+    `applied` replayed) as the new base marked through the newest settled
+    delta, then delete the deltas it covers. Returns the base generation
+    (unchanged if nothing was compacted or another writer won the race).
+    """
+    if len(applied) < DELTA_COMPACT_THRESHOLD:
+        return generation
+    settled = [name for name in sorted(applied) if _delta_time(name) < time.time() - DELTA_SETTLE_SECONDS]
+    if not settled:
+        return generation
+    
+    previous = index.applied_through
+    index.applied_through = settled[-1]
+    try:
+        generation = write_index(bucket, index, if_generation_match=generation)
+    except gcs_exceptions.PreconditionFailed:
+        index.applied_through = previous
+        logging.info("Vector index base changed concurrently - skipping compaction")
+        return generation
+    
+    for name in list_deltas(bucket):
+        if name > index.applied_through:
+            break
+        try:
+            bucket.blob(name).delete()
+        except gcs_exceptions.NotFound:
+            pass
+        except Exception as e:
+            logging.warning(f"⚠ Could not delete compacted delta {name}: {e}")
+        applied.discard(name)
+    logging.info(f"✓ Compacted {len(settled)} vector index delta(s) into generation {generation}")
+    return generation
@@ -0,0 +1,105 @@
+"""
+Recall/latency benchmark for the local vector indexes in findProduct/vector_index.py.
+
+Builds synthetic, clustered, L2-normalized 512-d catalogs of several sizes
+and compares IVFIndex against ExactIndex: recall@k of the approximate top-k
+against the exact top-k, and p50/p99 single-query latency.
+
+    python benchmarks/ann_benchmark.py --sizes 10000 50000 100000 --nprobe 4 8 16
+
+Needs the findProduct requirements (numpy, google-api-core) installed; no
+GCP access is used.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'findProduct'))
+
+import vector_index  # noqa: E402
+
+
+def make_catalog(size, dimension, rng):
+    """Clustered unit vectors (~50 products per cluster), like photos of similar items."""
+    clusters = max(1, size // 50)
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size)] + 0.6 * rng.normal(size=(size, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(catalog, count, rng):
+    """Noisy copies of catalog items, like a re-shot photo of a stocked product."""
+    picks = catalog[rng.integers(0, len(catalog), count)]
+    queries = picks + 0.3 * rng.normal(size=picks.shape).astype(np.float32) / np.sqrt(catalog.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def time_queries(index, queries, k):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, k))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def recall_at_k(approximate, exact):
+    hits = sum(len({i for i, _ in a} & {i for i, _ in e}) for a, e in zip(approximate, exact))
+    return hits / max(1, sum(len(e) for e in exact))
+
+
+def run(size, args, rng):
+    catalog = make_catalog(size, args.dimension, rng)
+    queries = make_queries(catalog, args.queries, rng)
+    ids = [f"product-{i}" for i in range(size)]
+
+    exact = vector_index.ExactIndex(dimension=args.dimension, capacity=size)
+    start = time.perf_counter()
+    for datapoint_id, vector in zip(ids, catalog):
+        exact.upsert(datapoint_id, vector)
+    insert_s = time.perf_counter() - start
+    exact_results, exact_p50, exact_p99 = time_queries(exact, queries, args.k)
+    print(f"{size:>8} {'exact':<10} {'-':>6} {insert_s:>9.2f} {1.0:>9.3f} {exact_p50:>9.3f} {exact_p99:>9.3f}")
+
+    start = time.perf_counter()
+    ivf = vector_index.IVFIndex.from_index(exact)
+    train_s = time.perf_counter() - start
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        ivf_results, p50, p99 = time_queries(ivf, queries, args.k)
+        recall = recall_at_k(ivf_results, exact_results)
+        print(f"{size:>8} {'ivf':<10} {nprobe:>6} {train_s:>9.2f} {recall:>9.3f} {p50:>9.3f} {p99:>9.3f}")
+
+    # Incremental maintenance on the trained index
+    start = time.perf_counter()
+    for i in range(args.churn):
+        ivf.remove(ids[i])
+        ivf.upsert(f"new-{i}", catalog[i])
+    churn_ms = (time.perf_counter() - start) * 1000 / max(1, args.churn)
+    blob = ivf.to_bytes()
+    print(f"{'':>8} ivf churn: {churn_ms:.3f} ms per delete+insert, serialized {len(blob) / 1e6:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=30)
+    parser.add_argument('--dimension', type=int, default=vector_index.DEFAULT_DIMENSION)
+    parser.add_argument('--churn', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'size':>8} {'index':<10} {'nprobe':>6} {'build s':>9} {'recall@' + str(args.k):>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for size in args.sizes:
+        run(size, args, rng)
+
+
+if __name__ == '__main__':
+    main()
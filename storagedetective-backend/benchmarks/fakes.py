@@ -0,0 +1,303 @@
+"""
+In-process stand-ins for the Google Cloud services the functions call.
+
+FakeBucket / FakeStorageClient implement the subset of google-cloud-storage
+used by catalog.py, vector_index.py and the function mains (generations and
+if_generation_match preconditions included). FakeEmbeddingModel and
+FakeMatchServiceClient answer like MultiModalEmbeddingModel and
+aiplatform_v1.MatchServiceClient with deterministic vectors.
+FakeHttpSession serves a generated JPEG per image URL (404 for URLs ending
+in BROKEN_IMAGE_SUFFIX). Every fake sleeps a configurable latency per call
+so numbers resemble network-bound behaviour.
+
+install() swaps the registry factories of a function's registry module for
+these fakes; the function code is otherwise unchanged. The benchmarks and
+generate_embeddings.py --dry-run both run on them.
+"""
+
+import hashlib
+import io
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from google.api_core import exceptions as gcs_exceptions
+
+DIMENSION = 512
+BROKEN_IMAGE_SUFFIX = "-broken.jpg"
+
+
+def _sleep(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def unit_vector(key, dimension=DIMENSION):
+    """Deterministic unit vector for a string or bytes key."""
+    data = key if isinstance(key, bytes) else key.encode('utf-8')
+    seed = int.from_bytes(hashlib.sha256(data).digest()[:8], 'big')
+    vector = np.random.default_rng(seed).normal(size=dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+# --- STORAGE ---
+class FakeBlob:
+    def __init__(self, bucket, name, generation=None):
+        self.bucket = bucket
+        self.name = name
+        self.generation = generation
+        self.size = None
+
+    def _load(self):
+        _sleep(self.bucket.latency)
+        item = self.bucket.objects.get(self.name)
+        if item is None:
+            raise gcs_exceptions.NotFound(self.name)
+        data, generation = item
+        self.generation, self.size = generation, len(data)
+        return data
+
+    def download_as_bytes(self, **kwargs):
+        return self._load()
+
+    download_as_string = download_as_bytes
+
+    def open(self, mode='r', encoding='utf-8'):
+        data = self._load()
+        return io.StringIO(data.decode(encoding)) if 'b' not in mode else io.BytesIO(data)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        _sleep(self.bucket.latency)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.bucket.lock:
+            current = self.bucket.objects.get(self.name, (None, 0))[1]
+            if if_generation_match is not None and current != if_generation_match:
+                raise gcs_exceptions.PreconditionFailed(self.name)
+            self.bucket.generation += 1
+            self.generation = self.bucket.generation
+            self.bucket.objects[self.name] = (data, self.generation)
+
+    def exists(self):
+        _sleep(self.bucket.latency)
+        return self.name in self.bucket.objects
+
+    def delete(self):
+        _sleep(self.bucket.latency)
+        with self.bucket.lock:
+            if self.bucket.objects.pop(self.name, None) is None:
+                raise gcs_exceptions.NotFound(self.name)
+
+    def reload(self):
+        self._load()
+
+
+class FakeBucket:
+    def __init__(self, name="fake-bucket", latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.objects = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def blob(self, name, generation=None):
+        return FakeBlob(self, name, generation)
+
+    def get_blob(self, name):
+        _sleep(self.latency)
+        item = self.objects.get(name)
+        if item is None:
+            return None
+        blob = FakeBlob(self, name, item[1])
+        blob.size = len(item[0])
+        return blob
+
+    def list_blobs(self, prefix='', fields=None, **kwargs):
+        _sleep(self.latency)
+        with self.lock:
+            items = sorted((name, gen) for name, (_, gen) in self.objects.items() if name.startswith(prefix))
+        return [FakeBlob(self, name, gen) for name, gen in items]
+
+    def put_json(self, name, payload):
+        FakeBlob(self, name).upload_from_string(json.dumps(payload))
+
+
+class FakeStorageClient:
+    """Every bucket name resolves to the same FakeBucket."""
+
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def bucket(self, name):
+        return self._bucket
+
+    def batch(self):
+        return _NoBatch()
+
+
+class _NoBatch:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# --- EMBEDDING MODEL ---
+class FakeEmbeddingModel:
+    """MultiModalEmbeddingModel look-alike: vectors derived from the image bytes or text."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+
+    def get_embeddings(self, image=None, contextual_text=None, dimension=DIMENSION, **kwargs):
+        _sleep(self.latency)
+        self.calls += 1
+        result = SimpleNamespace(image_embedding=None, text_embedding=None)
+        if image is not None:
+            result.image_embedding = unit_vector(image._image_bytes, dimension).tolist()
+        if contextual_text is not None:
+            result.text_embedding = unit_vector(contextual_text, dimension).tolist()
+        return result
+
+
+# --- VECTOR SEARCH ---
+class FakeMatchServiceClient:
+    """Exact dot-product neighbours over {datapoint_id: vector}, shaped like MatchService responses."""
+
+    def __init__(self, vectors, latency=0.01):
+        self.latency = latency
+        self.ids = list(vectors)
+        self.vectors = {pid: np.asarray(v, dtype=np.float32) for pid, v in vectors.items()}
+        self.matrix = np.stack([self.vectors[pid] for pid in self.ids]) if self.ids else np.zeros((0, DIMENSION))
+
+    def find_neighbors(self, request):
+        _sleep(self.latency)
+        nearest = []
+        for query in request.queries:
+            vector = np.asarray(list(query.datapoint.feature_vector), dtype=np.float32)
+            scores = self.matrix @ vector
+            k = min(query.neighbor_count, len(self.ids))
+            top = np.argsort(-scores)[:k]
+            nearest.append(SimpleNamespace(
+                id=query.datapoint.datapoint_id,
+                neighbors=[
+                    SimpleNamespace(datapoint=SimpleNamespace(datapoint_id=self.ids[i]), distance=float(scores[i]))
+                    for i in top
+                ]
+            ))
+        return SimpleNamespace(nearest_neighbors=nearest)
+
+    def read_index_datapoints(self, request):
+        _sleep(self.latency)
+        return SimpleNamespace(datapoints=[
+            SimpleNamespace(datapoint_id=pid, feature_vector=self.vectors[pid].tolist())
+            for pid in request.ids if pid in self.vectors
+        ])
+
+
+class FakeMatchingEngineIndex:
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.datapoints = {}
+
+    def upsert_datapoints(self, datapoints):
+        _sleep(self.latency)
+        for datapoint in datapoints:
+            self.datapoints[datapoint['datapoint_id']] = datapoint['feature_vector']
+
+    def remove_datapoints(self, datapoint_ids):
+        _sleep(self.latency)
+        for datapoint_id in datapoint_ids:
+            self.datapoints.pop(datapoint_id, None)
+
+
+# --- IMAGE DOWNLOADS ---
+def fake_jpeg(key, size=(1200, 900)):
+    """A JPEG photo stand-in whose colours depend on `key`."""
+    from PIL import Image
+    r, g, b = hashlib.sha256(key.encode('utf-8')).digest()[:3]
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    image = Image.blend(image, Image.new('RGB', size, (r, g, b)), 0.5)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def _not_found(url):
+    def raise_for_status():
+        raise IOError(f"404 for {url}")
+    return raise_for_status
+
+
+class FakeHttpSession:
+    def __init__(self, latency=0.02, image_size=(1200, 900)):
+        self.latency = latency
+        self.image_size = image_size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, timeout=None):
+        _sleep(self.latency)
+        if url.endswith(BROKEN_IMAGE_SUFFIX):
+            return SimpleNamespace(content=b'', raise_for_status=_not_found(url))
+        with self._lock:
+            content = self._cache.get(url)
+        if content is None:
+            content = fake_jpeg(url, self.image_size)
+            with self._lock:
+                self._cache[url] = content
+        return SimpleNamespace(content=content, raise_for_status=lambda: None)
+
+
+# --- SYNTHETIC CATALOG ---
+WORDS = (
+    "drill screw bolt hammer wrench pliers socket cable adapter bracket hinge valve "
+    "pump filter gasket washer nut clamp hose fitting relay switch sensor motor bearing "
+    "spring chain belt pulley tape glue brush saw blade level ruler marker battery"
+).split()
+
+
+def product_json(i, images_per_product=2):
+    rng = np.random.default_rng(i)
+    title = " ".join(rng.choice(WORDS, 3))
+    product_id = f"product-{i:06d}"
+    return product_id, {
+        'id': product_id,
+        'structData': {
+            'internalId': product_id,
+            'title': title.title(),
+            'description': " ".join(rng.choice(WORDS, 12)),
+            'catalogNumber': f"CAT-{i:06d}",
+            'categories': [str(rng.choice(WORDS))],
+            'images': [
+                {'uri': f"https://fake.invalid/images/{product_id}_{n}.jpg"}
+                for n in range(images_per_product)
+            ]
+        }
+    }
+
+
+def make_catalog(size, gcs_latency=0.0):
+    """FakeBucket with `size` product JSONs plus {product_id: vector} for the fake index."""
+    bucket = FakeBucket(latency=0.0)
+    vectors = {}
+    for i in range(size):
+        product_id, payload = product_json(i)
+        bucket.put_json(f"json/{product_id}.json", payload)
+        vectors[product_id] = unit_vector(product_id)
+    bucket.latency = gcs_latency
+    return bucket, vectors
+
+
+def install(registry, bucket, model, match_client, index, http_session):
+    """Point a function's registry factories at the fakes."""
+    storage_client = FakeStorageClient(bucket)
+    registry.storage_client = lambda: storage_client
+    registry.embedding_model = lambda name=None: model
+    registry.match_service_client = lambda api_endpoint=None: match_client
+    registry.matching_engine_index = lambda index_name=None: index
+    registry.http_session = lambda pool_size=None: http_session
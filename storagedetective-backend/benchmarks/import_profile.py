@@ -0,0 +1,155 @@
+"""
+Import-time (cold start) profile of each Cloud Function.
+
+For every function directory a fresh interpreter imports main under
+`python -X importtime`. Reported per function: seconds to import main (best
+of --repeat runs), its heaviest direct imports by cumulative time, and self
+time summed by top-level package - the part of every cold start that is paid
+before the first request is served.
+
+    python benchmarks/import_profile.py
+    python benchmarks/import_profile.py --functions findProduct --top 15
+    python benchmarks/import_profile.py --history benchmarks/import_history.jsonl
+
+--history appends one JSON line per function (timestamp, git commit, import
+seconds, heaviest packages) so cold-start seconds can be tracked over time.
+Needs each function's requirements installed; importing a main makes no GCP
+calls.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FUNCTIONS = ['findProduct', 'getProduct', 'addProduct', 'addProductEmbedding']
+
+IMPORT_MAIN = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+
+
+# --- PROFILING ---
+def parse_importtime(stderr):
+    """[(self_us, cumulative_us, level, module)] from -X importtime output, in report order."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|', 2)
+        # Nesting is shown as two spaces per level after the separator's space
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((int(self_us), int(cumulative_us), level, name.strip()))
+    return entries
+
+
+def main_block(entries):
+    """The entries imported by `main` (they precede it in the report), plus main's own entry."""
+    for position, (_, _, level, module) in enumerate(entries):
+        if module == 'main' and level == 0:
+            start = position
+            while start > 0 and entries[start - 1][2] > 0:
+                start -= 1
+            return entries[start:position], entries[position]
+    return [], None
+
+
+def profile_function(function, repeat):
+    """Import main of `function` `repeat` times in fresh interpreters; profile of the fastest run."""
+    best = None
+    for _ in range(max(1, repeat)):
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', IMPORT_MAIN],
+            cwd=os.path.join(BACKEND_DIR, function), capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            errors = [line for line in completed.stderr.splitlines() if not line.startswith('import time:')]
+            return {'error': errors[-1] if errors else 'import failed'}
+        seconds = float(completed.stdout.strip().splitlines()[-1])
+        if best is None or seconds < best[0]:
+            best = (seconds, completed.stderr)
+
+    seconds, stderr = best
+    block, main_entry = main_block(parse_importtime(stderr))
+    by_package = defaultdict(int)
+    for self_us, _, _, module in block:
+        by_package[module.split('.')[0]] += self_us
+    return {
+        'import_seconds': round(seconds, 4),
+        'main_self_seconds': round(main_entry[0] / 1e6, 4) if main_entry else None,
+        'modules': len(block),
+        'direct_imports': [
+            {'module': module, 'seconds': round(cumulative_us / 1e6, 4)}
+            for _, cumulative_us, level, module in sorted(block, key=lambda e: -e[1]) if level == 1
+        ],
+        'packages': [
+            {'package': package, 'seconds': round(self_us / 1e6, 4)}
+            for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])
+        ]
+    }
+
+
+# --- REPORTING ---
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_report(function, result, top):
+    print(f"\n{function}")
+    if 'error' in result:
+        print(f"  ✗ {result['error']}")
+        return
+    print(f"  import main: {result['import_seconds'] * 1000:.0f}ms ({result['modules']} modules)")
+    print(f"  {'heaviest direct imports':<40}{'ms':>10}")
+    for item in result['direct_imports'][:top]:
+        print(f"  {item['module']:<40}{item['seconds'] * 1000:>10.1f}")
+    print(f"  {'self time by package':<40}{'ms':>10}")
+    for item in result['packages'][:top]:
+        print(f"  {item['package']:<40}{item['seconds'] * 1000:>10.1f}")
+
+
+def append_history(path, results, top):
+    recorded_at = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    commit = git_commit()
+    with open(path, 'a') as f:
+        for function, result in results.items():
+            if 'error' in result:
+                continue
+            f.write(json.dumps({
+                'recorded_at': recorded_at,
+                'commit': commit,
+                'function': function,
+                'import_seconds': result['import_seconds'],
+                'modules': result['modules'],
+                'packages': result['packages'][:top]
+            }) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS, default=FUNCTIONS)
+    parser.add_argument('--repeat', type=int, default=3, help="fresh imports per function (fastest is kept)")
+    parser.add_argument('--top', type=int, default=10, help="rows per table")
+    parser.add_argument('--history', help="append results to this JSONL file")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {function: profile_function(function, args.repeat) for function in args.functions}
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for function, result in results.items():
+            print_report(function, result, args.top)
+    if args.history:
+        append_history(args.history, results, args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Offline latency benchmark for find_product, get_products and add_product_embedding.
+
+Each (function, catalog size) pair runs in a fresh subprocess so that the
+import and first request form a real cold start. Inside it the function's
+registry is pointed at the in-process fakes in benchmarks/fakes.py: a
+bucket holding N synthetic product JSONs, an embedding model, Vector Search
+(MatchService + index) and image downloads, each with a configurable
+per-call latency. Reported per operation: p50/p95/p99 latency of sequential
+requests and throughput with --concurrency parallel clients.
+
+    python benchmarks/service_benchmark.py --sizes 100 1000 5000
+    python benchmarks/service_benchmark.py --functions find_product --model-latency-ms 80
+
+Needs each function's requirements installed (Flask, functions-framework,
+google-cloud-aiplatform, cloudevents, numpy, Pillow); no GCP access is used.
+"""
+
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FUNCTION_DIRS = {
+    'find_product': 'findProduct',
+    'get_products': 'getProduct',
+    'add_product_embedding': 'addProductEmbedding',
+}
+
+
+# --- MEASUREMENT ---
+def summarize(latencies):
+    values = np.asarray(latencies) * 1000
+    return {
+        'count': len(values),
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p95': round(float(np.percentile(values, 95)), 2),
+        'p99': round(float(np.percentile(values, 99)), 2),
+    }
+
+
+def measure(op, count, concurrency):
+    """Latency percentiles of `count` sequential calls of op(i), then throughput with `concurrency` clients."""
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        op(i)
+        latencies.append(time.perf_counter() - start)
+    result = summarize(latencies)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(op, range(count, 2 * count)))
+    result['rps'] = round(count / (time.perf_counter() - start), 1)
+    return result
+
+
+def make_request(method='GET', json_body=None, query=None, headers=None):
+    import flask
+    from werkzeug.test import EnvironBuilder
+    builder = EnvironBuilder(method=method, json=json_body, query_string=query, headers=headers)
+    return builder.get_request(cls=flask.Request)
+
+
+def consume(response):
+    """Drain a handler result; streamed Flask Responses are iterated to the end."""
+    if isinstance(response, tuple):
+        status = response[1]
+    else:
+        for _ in response.response:
+            pass
+        status = response.status_code
+    if status >= 500:
+        raise RuntimeError(f"handler returned {status}: {response[0] if isinstance(response, tuple) else ''}")
+    return response
+
+
+# --- WORKERS (run inside the subprocess) ---
+def load_function(function, args, size):
+    """Build the fakes, install them in the function's registry and import its main (timed)."""
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    sys.path.insert(0, os.path.join(BACKEND_DIR, FUNCTION_DIRS[function]))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import fakes
+    import registry
+
+    bucket, vectors = fakes.make_catalog(size, args.gcs_latency_ms / 1000)
+    world = {
+        'bucket': bucket,
+        'model': fakes.FakeEmbeddingModel(args.model_latency_ms / 1000),
+        'match': fakes.FakeMatchServiceClient(vectors, args.search_latency_ms / 1000),
+        'index': fakes.FakeMatchingEngineIndex(args.search_latency_ms / 1000),
+        'http': fakes.FakeHttpSession(args.download_latency_ms / 1000),
+        'fakes': fakes,
+    }
+    fakes.install(registry, world['bucket'], world['model'], world['match'], world['index'], world['http'])
+
+    start = time.perf_counter()
+    import main
+    world['import_seconds'] = time.perf_counter() - start
+    return main, world
+
+
+def bench_find_product(args, size):
+    main, world = load_function('find_product', args, size)
+    fakes = world['fakes']
+    rng = np.random.default_rng(size)
+    text_queries = [" ".join(rng.choice(fakes.WORDS, 2)) for _ in range(4 * args.requests)]
+    images = [base64.b64encode(fakes.fake_jpeg(f"query-{i}", (800, 600))).decode() for i in range(2 * args.requests)]
+
+    def search(body):
+        return consume(main.find_product(make_request('POST', body)))
+
+    start = time.perf_counter()
+    search({'text_query': text_queries[0]})
+    cold = time.perf_counter() - start
+
+    ops = {
+        'text': measure(lambda i: search({'text_query': f"{text_queries[i]} {i}"}), args.requests, args.concurrency),
+        'image': measure(lambda i: search({'image_base64': images[i]}), args.requests, args.concurrency),
+        'batch8': measure(lambda i: search({'queries': [{'text_query': f"{q} {i}"} for q in text_queries[i:i + 8]]}),
+                          max(1, args.requests // 4), args.concurrency),
+    }
+    return {'import_ms': world['import_seconds'] * 1000, 'cold_request_ms': cold * 1000, 'ops': ops}
+
+
+def bench_get_products(args, size):
+    main, world = load_function('get_products', args, size)
+
+    def get(query=None, headers=None):
+        return consume(main.get_products(make_request('GET', query=query, headers=headers)))
+
+    start = time.perf_counter()
+    first = get()
+    cold = time.perf_counter() - start
+    etag = first[2].get('ETag', '')
+
+    ops = {
+        'catalog': measure(lambda i: get(), args.requests, args.concurrency),
+        'page50': measure(lambda i: get({'limit': 50, 'page': 1 + i % 5}), args.requests, args.concurrency),
+        'stats': measure(lambda i: get({'view': 'stats'}), args.requests, args.concurrency),
+        'not_modified': measure(lambda i: get(headers={'If-None-Match': etag}), args.requests, args.concurrency),
+        'ndjson': measure(lambda i: get({'format': 'ndjson'}), max(1, args.requests // 4), args.concurrency),
+    }
+    return {'import_ms': world['import_seconds'] * 1000, 'cold_request_ms': cold * 1000, 'ops': ops}
+
+
+def bench_add_product_embedding(args, size):
+    from cloudevents.http import CloudEvent
+    main, world = load_function('add_product_embedding', args, size)
+    fakes, bucket = world['fakes'], world['bucket']
+
+    def deliver(name, event_id=None):
+        blob = bucket.get_blob(name)
+        event = CloudEvent(
+            {
+                'type': 'google.cloud.storage.object.v1.finalized',
+                'source': f"//storage.googleapis.com/projects/_/buckets/{bucket.name}",
+                'id': event_id or uuid.uuid4().hex,
+            },
+            {'bucket': bucket.name, 'name': name, 'generation': str(blob.generation)}
+        )
+        main.add_product_embedding(event)
+        return event['id']
+
+    def write_new(i):
+        product_id, payload = fakes.product_json(size + i)
+        name = f"json/{product_id}.json"
+        bucket.put_json(name, payload)
+        return name, payload
+
+    start = time.perf_counter()
+    deliver(write_new(0)[0])
+    cold = time.perf_counter() - start
+
+    written = {}
+
+    def new_product(i):
+        name, payload = write_new(1 + i)
+        written[i] = (name, payload, deliver(name))
+
+    def metadata_only(i):
+        name, payload, _ = written[i % args.requests]
+        payload['structData']['title'] += " v2"
+        bucket.put_json(name, payload)
+        deliver(name)
+
+    def duplicate(i):
+        name, _, event_id = written[i % args.requests]
+        deliver(name, event_id)
+
+    ops = {
+        'new_product': measure(new_product, args.requests, args.concurrency),
+        'metadata_only': measure(metadata_only, args.requests, args.concurrency),
+        'duplicate_event': measure(duplicate, args.requests, args.concurrency),
+    }
+    return {
+        'import_ms': world['import_seconds'] * 1000,
+        'cold_request_ms': cold * 1000,
+        'model_calls': world['model'].calls,
+        'ops': ops
+    }
+
+
+BENCHMARKS = {
+    'find_product': bench_find_product,
+    'get_products': bench_get_products,
+    'add_product_embedding': bench_add_product_embedding,
+}
+
+
+# --- DRIVER ---
+def run_worker(function, size, args):
+    command = [
+        sys.executable, os.path.abspath(__file__), '--worker', function, '--sizes', str(size),
+        '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+        '--model-latency-ms', str(args.model_latency_ms), '--search-latency-ms', str(args.search_latency_ms),
+        '--gcs-latency-ms', str(args.gcs_latency_ms), '--download-latency-ms', str(args.download_latency_ms),
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_report(function, size, result):
+    print(f"\n{function} @ {size} products")
+    if 'error' in result:
+        print(f"  ✗ {result['error']}")
+        return
+    print(f"  cold start: import {result['import_ms']:.0f}ms + first request {result['cold_request_ms']:.0f}ms")
+    print(f"  {'operation':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for name, op in result['ops'].items():
+        print(f"  {name:<16}{op['p50']:>10.1f}{op['p95']:>10.1f}{op['p99']:>10.1f}{op['rps']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--functions', nargs='+', choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--requests', type=int, default=50, help="requests per operation")
+    parser.add_argument('--concurrency', type=int, default=8, help="parallel clients for throughput")
+    parser.add_argument('--model-latency-ms', type=float, default=60)
+    parser.add_argument('--search-latency-ms', type=float, default=15)
+    parser.add_argument('--gcs-latency-ms', type=float, default=5)
+    parser.add_argument('--download-latency-ms', type=float, default=20)
+    parser.add_argument('--worker', choices=sorted(BENCHMARKS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(BENCHMARKS[args.worker](args, args.sizes[0])))
+        return
+
+    for function in args.functions:
+        for size in args.sizes:
+            print_report(function, size, run_worker(function, size, args))
+
+
+if __name__ == '__main__':
+    main()
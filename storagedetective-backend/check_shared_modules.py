@@ -0,0 +1,81 @@
+# check_shared_modules.py - PRE-DEPLOY CHECK FOR COPIED MODULES
+"""
+Fail if the copies of a shared module differ between function folders.
+
+Each Cloud Function deploys only its own folder, so helper modules
+(catalog.py, registry.py, timing.py, ...) are copied into every function
+that uses them. Any module file that appears in more than one function
+folder must be byte-identical everywhere. Run this before deploying:
+
+    python check_shared_modules.py
+
+--sync FOLDER copies that folder's version of every differing module over
+the other copies (after you have edited one of them).
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+ENTRY_POINT = "main.py"
+
+
+def function_dirs():
+    """Folders deployed as Cloud Functions (those with a main.py)."""
+    return sorted(
+        name for name in os.listdir(BACKEND_DIR)
+        if os.path.isfile(os.path.join(BACKEND_DIR, name, ENTRY_POINT))
+    )
+
+
+def shared_modules():
+    """{module file name: [function folder, ...]} for modules found in 2+ folders."""
+    found = defaultdict(list)
+    for folder in function_dirs():
+        for name in os.listdir(os.path.join(BACKEND_DIR, folder)):
+            if name.endswith('.py') and name != ENTRY_POINT:
+                found[name].append(folder)
+    return {name: folders for name, folders in sorted(found.items()) if len(folders) > 1}
+
+
+def digest(folder, name):
+    with open(os.path.join(BACKEND_DIR, folder, name), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sync', metavar='FOLDER', help="copy this folder's versions over differing copies")
+    args = parser.parse_args()
+
+    differing = 0
+    for name, folders in shared_modules().items():
+        digests = {folder: digest(folder, name) for folder in folders}
+        if len(set(digests.values())) == 1:
+            print(f"✓ {name}: identical in {', '.join(folders)}")
+            continue
+
+        if args.sync in digests:
+            source = os.path.join(BACKEND_DIR, args.sync, name)
+            for folder in folders:
+                if digests[folder] != digests[args.sync]:
+                    shutil.copyfile(source, os.path.join(BACKEND_DIR, folder, name))
+                    print(f"⚠ {name}: copied {args.sync}/ over {folder}/")
+            continue
+
+        differing += 1
+        print(f"✗ {name} differs:")
+        for folder, value in digests.items():
+            print(f"    {value[:12]}  {folder}/{name}")
+
+    if differing:
+        print(f"\n{differing} shared module(s) out of sync - fix them or rerun with --sync FOLDER")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
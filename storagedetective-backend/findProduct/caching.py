@@ -0,0 +1,215 @@
+"""
+In-process caches for find_product.
+
+TTLCache is a thread-safe LRU map whose entries also expire after a TTL.
+GcsCacheTier optionally persists an embedding cache to a GCS object so that
+new instances start warm. SingleFlight coalesces concurrent identical work
+(catalog loads, embedding calls, neighbor queries) into one backend call.
+"""
+
+import array
+import base64
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded LRU cache with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value or None; refreshes the entry's LRU position."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and time.time() - item[1] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, stored_at=None):
+        with self._lock:
+            self._entries[key] = (value, stored_at or time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._entries.pop(key, None)
+            return item[0] if item else None
+
+    def items(self):
+        """Live (key, value, stored_at) triples, least recently used first."""
+        now = time.time()
+        with self._lock:
+            return [
+                (key, value, stored_at)
+                for key, (value, stored_at) in self._entries.items()
+                if now - stored_at < self.ttl_seconds
+            ]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None
+        }
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Concurrent do(key, fn) calls with the same key run fn once: the first
+    caller computes, callers arriving while it is in flight wait and receive
+    its result or exception. Completed calls are forgotten immediately, so
+    this coalesces only - pair it with a cache for reuse.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(*args, **kwargs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+            if flight.waiters:
+                logging.info(f"Single-flight {self.name}: {flight.waiters} caller(s) shared one call")
+        return flight.result
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+
+def _encode_vector(vector):
+    return base64.b64encode(array.array('f', vector).tobytes()).decode('ascii')
+
+
+def _decode_vector(encoded):
+    values = array.array('f')
+    values.frombytes(base64.b64decode(encoded))
+    return values.tolist()
+
+
+class GcsCacheTier:
+    """
+    Persists an embedding TTLCache to one GCS object (vectors as base64
+    float32). Loaded once per instance; written back in a background thread
+    after `flush_every` new entries or `flush_seconds`, whichever comes first.
+    Last writer wins across instances, which is fine for a cache.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, bucket_getter, blob_name, flush_every=25, flush_seconds=300):
+        self.bucket_getter = bucket_getter
+        self.blob_name = blob_name
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.loaded = False
+        self._pending = 0
+        self._last_flush = time.time()
+        self._load_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def load_into(self, cache):
+        """Populate `cache` from GCS once; later calls are no-ops."""
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            try:
+                blob = self.bucket_getter().blob(self.blob_name)
+                data = json.loads(blob.download_as_bytes())
+                if data.get('version') == self.FORMAT_VERSION:
+                    for key, stored_at, encoded in data.get('entries', []):
+                        cache.put(key, _decode_vector(encoded), stored_at)
+                logging.info(f"✓ Loaded {len(cache)} cached embeddings from {self.blob_name}")
+            except Exception as e:
+                logging.info(f"No persisted embedding cache loaded: {e}")
+            self.loaded = True
+
+    def note_write(self, cache):
+        """Record a new cache entry and flush in the background when due."""
+        self._pending += 1
+        due = self._pending >= self.flush_every or time.time() - self._last_flush >= self.flush_seconds
+        if due and self._flush_lock.acquire(blocking=False):
+            threading.Thread(target=self._flush, args=(cache,), daemon=True).start()
+
+    def _flush(self, cache):
+        try:
+            self._pending = 0
+            self._last_flush = time.time()
+            payload = {
+                'version': self.FORMAT_VERSION,
+                'entries': [
+                    [key, stored_at, _encode_vector(value)]
+                    for key, value, stored_at in cache.items()
+                ]
+            }
+            blob = self.bucket_getter().blob(self.blob_name)
+            blob.upload_from_string(json.dumps(payload), content_type='application/json')
+            logging.info(f"✓ Persisted {len(payload['entries'])} cached embeddings")
+        except Exception as e:
+            logging.warning(f"Failed to persist embedding cache: {e}")
+        finally:
+            self._flush_lock.release()
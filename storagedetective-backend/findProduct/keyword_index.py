@@ -0,0 +1,177 @@
+"""
+Tokenized inverted index over product title, description and categories
+with BM25F (field-weighted BM25) scoring.
+
+Built once from PRODUCT_METADATA_CACHE and updated per product as the cache
+refreshes. Keyword scoring is a posting-list lookup instead of a substring
+scan over every candidate, and it covers the whole catalog, not only the
+vector search candidates.
+"""
+
+import bisect
+import math
+import re
+import threading
+
+FIELDS = ('title', 'description', 'categories')
+FIELD_WEIGHTS = (2.0, 1.0, 1.0)  # title matches count double, as in the old substring scorer
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# A query token also matches longer terms it prefixes ("screw" -> "screwdriver"),
+# at reduced weight, which keeps the partial-word behaviour of the substring scan.
+PREFIX_MATCH_WEIGHT = 0.5
+MAX_PREFIX_EXPANSIONS = 50
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.casefold()) if text else []
+
+
+def product_fields(product):
+    """Token lists for each indexed field of a normalized product record."""
+    categories = product.get('categories') or []
+    if isinstance(categories, str):
+        categories = [categories]
+    return (
+        tokenize(product.get('title', '')),
+        tokenize(product.get('description', '')),
+        tokenize(' '.join(str(c) for c in categories))
+    )
+
+
+class KeywordIndex:
+    """Inverted index: term -> {product_id: per-field term frequencies}."""
+
+    def __init__(self):
+        self._postings = {}
+        self._doc_terms = {}    # product_id -> set of terms (for removal)
+        self._doc_lengths = {}  # product_id -> per-field token counts
+        self._field_totals = [0] * len(FIELDS)
+        self._norms = {}        # product_id -> per-field BM25 length norms
+        self._norms_dirty = True
+        self._vocabulary = []
+        self._vocabulary_dirty = True
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    @classmethod
+    def from_products(cls, products):
+        """Build from a {product_id: product} mapping."""
+        index = cls()
+        for product_id, product in products.items():
+            index.add(product_id, product)
+        return index
+
+    def add(self, product_id, product):
+        """Index (or re-index) one product."""
+        fields = product_fields(product)
+        with self._lock:
+            self.remove(product_id)
+            terms = set()
+            for field_number, tokens in enumerate(fields):
+                for token in tokens:
+                    tfs = self._postings.setdefault(token, {}).setdefault(product_id, [0] * len(FIELDS))
+                    tfs[field_number] += 1
+                    terms.add(token)
+                self._field_totals[field_number] += len(tokens)
+            self._doc_terms[product_id] = terms
+            self._doc_lengths[product_id] = tuple(len(tokens) for tokens in fields)
+            self._norms_dirty = True
+            self._vocabulary_dirty = True
+
+    def remove(self, product_id):
+        with self._lock:
+            terms = self._doc_terms.pop(product_id, None)
+            if terms is None:
+                return False
+            for term in terms:
+                postings = self._postings[term]
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[term]
+            lengths = self._doc_lengths.pop(product_id)
+            for field_number, length in enumerate(lengths):
+                self._field_totals[field_number] -= length
+            self._norms_dirty = True
+            self._vocabulary_dirty = True
+            return True
+
+    def _refresh_norms(self):
+        """Precompute per-document field length norms (1 - b + b * len / avg_len)."""
+        count = max(1, len(self._doc_lengths))
+        averages = [max(1e-9, total / count) for total in self._field_totals]
+        self._norms = {
+            product_id: tuple(1 - BM25_B + BM25_B * length / average for length, average in zip(lengths, averages))
+            for product_id, lengths in self._doc_lengths.items()
+        }
+        self._norms_dirty = False
+
+    def _expand(self, token):
+        """[(term, weight)] for a query token: the exact term plus prefix matches."""
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        expansions = []
+        start = bisect.bisect_left(self._vocabulary, token)
+        for term in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS + 1]:
+            if not term.startswith(token):
+                break
+            expansions.append((term, 1.0 if term == token else PREFIX_MATCH_WEIGHT))
+        return expansions
+
+    def score(self, query, product_ids=None):
+        """
+        BM25F scores for a free-text query.
+        Returns {product_id: (score, number of query tokens matched)}, only for
+        products matching at least one token; restricted to `product_ids` if given.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        allowed = set(product_ids) if product_ids is not None else None
+        results = {}
+        with self._lock:
+            if self._norms_dirty:
+                self._refresh_norms()
+            doc_count = len(self._doc_lengths)
+            for token in tokens:
+                token_scores = {}
+                for term, weight in self._expand(token):
+                    postings = self._postings[term]
+                    df = len(postings)
+                    idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                    for product_id, tfs in postings.items():
+                        if allowed is not None and product_id not in allowed:
+                            continue
+                        norms = self._norms[product_id]
+                        tf = sum(w * f / n for w, f, n in zip(FIELD_WEIGHTS, tfs, norms))
+                        term_score = weight * idf * tf * (BM25_K1 + 1) / (BM25_K1 + tf)
+                        if term_score > token_scores.get(product_id, 0.0):
+                            token_scores[product_id] = term_score
+                for product_id, term_score in token_scores.items():
+                    score, matched = results.get(product_id, (0.0, 0))
+                    results[product_id] = (score + term_score, matched + 1)
+        return results
+
+    def title_matches(self, query):
+        """Ids of products whose title contains every query token as a whole word."""
+        tokens = set(tokenize(query))
+        if not tokens:
+            return set()
+        with self._lock:
+            matches = None
+            for token in tokens:
+                titled = {product_id for product_id, tfs in self._postings.get(token, {}).items() if tfs[0]}
+                matches = titled if matches is None else matches & titled
+        return matches
+
+    def search(self, query, limit=None):
+        """Rank the whole catalog: [(product_id, score, tokens matched)], best first."""
+        scored = self.score(query)
+        ranked = sorted(scored.items(), key=lambda item: (-item[1][0], item[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(product_id, score, matched) for product_id, (score, matched) in ranked]
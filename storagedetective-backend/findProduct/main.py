@@ -1,12 +1,23 @@
 import logging
 import json
 import base64
+import hashlib
+import os
+import secrets
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 import functions_framework
-import vertexai
-from vertexai.vision_models import MultiModalEmbeddingModel, Image as VertexImage
-from google.cloud import aiplatform_v1
-from google.cloud import storage
+import numpy as np
+
+import caching
+import catalog
+import image_preprocess
+import keyword_index
+import registry
+import timing
+import vector_index
 
 logging.basicConfig(level=logging.INFO)
 
@@ -18,6 +29,8 @@ API_ENDPOINT = "1073841879.us-central1-325488595361.vdb.vertexai.goog"
 INDEX_ENDPOINT = "projects/325488595361/locations/us-central1/indexEndpoints/5301530608810328064"
 DEPLOYED_INDEX_ID = "product_search_endpoint_v1_1759833776131"
 
+EMBEDDING_MODEL_NAME = "multimodalembedding@001"
+
 METADATA_BUCKET = "storagedetective.firebasestorage.app"
 METADATA_PREFIX = "json/"
 
@@ -28,96 +41,493 @@ IMAGE_SEARCH_FALLBACK_THRESHOLD = 0.0  # For "at least 1 result" fallback
 # Maximum candidates to fetch
 MAX_CANDIDATES = 30
 
-# Initialize Vertex AI
-vertexai.init(project=PROJECT_ID, location=LOCATION)
+# Hybrid text retrieval: lexical candidates from the whole catalog are fused
+# with the vector candidates by reciprocal rank fusion. Products whose title
+# contains every query token rank ahead of the rest, so an exact title match
+# found only by the lexical index is not buried by the vector rank.
+LEXICAL_CANDIDATES = int(os.environ.get("LEXICAL_CANDIDATES", "100"))
+RRF_K = 60
+
+# Batch search: a shelf of queries embedded concurrently and answered by one
+# multi-query neighbor request
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "32"))
+QUERY_EMBED_WORKERS = int(os.environ.get("QUERY_EMBED_WORKERS", "8"))
+
+# Ranked result lists kept for cursor pagination. They live in one
+# instance's memory: a cursor that reaches another instance (or expires) gets
+# 410, and the client re-runs the search with an offset instead.
+RESULT_CURSOR_CACHE_SIZE = int(os.environ.get("RESULT_CURSOR_CACHE_SIZE", "500"))
+RESULT_CURSOR_TTL_SECONDS = int(os.environ.get("RESULT_CURSOR_TTL_SECONDS", "600"))
+
+# Query embedding cache (text by normalized query, images by SHA-256 of the bytes).
+# Set EMBEDDING_CACHE_OBJECT to a blob name in METADATA_BUCKET to persist it.
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", "86400"))
+EMBEDDING_CACHE_OBJECT = os.environ.get("EMBEDDING_CACHE_OBJECT", "")
+
+# Vector search backend: "remote" (Vertex AI MatchService), "local" (in-process
+# index from catalog/vectors.npz) or "shadow" (serve remote, compare local).
+# LOCAL_INDEX_KIND picks exact brute force or the IVF approximate index.
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "remote")
+LOCAL_INDEX_KIND = os.environ.get("LOCAL_INDEX_KIND", "exact")
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", str(vector_index.IVF_DEFAULT_NPROBE)))
+READ_DATAPOINTS_BATCH = 100
+
+# Instance warm-up: WARMUP_ON_START=1 loads the catalog, the embedding model
+# and the Vector Search channel on a background thread at instance start.
+# Requests wait up to WARMUP_WAIT_SECONDS for it instead of repeating the work.
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "0") == "1"
+WARMUP_WAIT_SECONDS = float(os.environ.get("WARMUP_WAIT_SECONDS", "60"))
+WARMUP_CHANNEL_TIMEOUT_SECONDS = float(os.environ.get("WARMUP_CHANNEL_TIMEOUT_SECONDS", "10"))
+
+# Vertex AI is initialized on first use (see registry.configure_vertex); the
+# vertexai / aiplatform_v1 modules are imported where they are needed so cold
+# starts and OPTIONS preflights do not load them.
+registry.configure_vertex(PROJECT_ID, LOCATION)
 
 # Global cache for product metadata
 PRODUCT_METADATA_CACHE = {}
 METADATA_LOADED = False
 
+# Delta refresh state: json/ blob name -> catalog entry, plus unparseable blobs.
+# Refreshes build new dicts and swap them in, so searches never see a partial cache.
+METADATA_REFRESH_SECONDS = int(os.environ.get("METADATA_REFRESH_SECONDS", "300"))
+CATALOG_ENTRIES = {}
+CATALOG_SKIPPED = {}
+CACHE_GENERATION = 0
+CACHE_REFRESHED_AT = 0.0
+KEYWORD_INDEX = None
+_metadata_lock = threading.Lock()
 
-def load_product_metadata():
-    """Load product metadata from GCS JSON files into memory cache."""
-    global PRODUCT_METADATA_CACHE, METADATA_LOADED
+
+def _metadata_bucket():
+    return registry.storage_client().bucket(METADATA_BUCKET)
+
+
+QUERY_EMBEDDING_CACHE = caching.TTLCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS)
+RESULT_LIST_CACHE = caching.TTLCache(RESULT_CURSOR_CACHE_SIZE, RESULT_CURSOR_TTL_SECONDS)
+EMBEDDING_CACHE_TIER = (
+    caching.GcsCacheTier(_metadata_bucket, EMBEDDING_CACHE_OBJECT) if EMBEDDING_CACHE_OBJECT else None
+)
+
+# Concurrent identical work (cold catalog loads, the same query embedding,
+# the same neighbor query) runs once; the other callers wait for its result.
+CATALOG_FLIGHT = caching.SingleFlight("catalog")
+EMBEDDING_FLIGHTS = caching.SingleFlight("embedding")
+NEIGHBOR_FLIGHTS = caching.SingleFlight("neighbors")
+
+
+def _apply_catalog(by_name, skipped):
+    """Swap in a new metadata cache built from catalog entries and patch the keyword index."""
+    global PRODUCT_METADATA_CACHE, CATALOG_ENTRIES, CATALOG_SKIPPED, CACHE_GENERATION, KEYWORD_INDEX
     
+    previous = PRODUCT_METADATA_CACHE
+    current = {entry['id']: entry['product'] for entry in by_name.values()}
+    
+    if KEYWORD_INDEX is None:
+        KEYWORD_INDEX = keyword_index.KeywordIndex.from_products(current)
+    else:
+        for product_id in previous.keys() - current.keys():
+            KEYWORD_INDEX.remove(product_id)
+        for product_id, product in current.items():
+            if previous.get(product_id) != product:
+                KEYWORD_INDEX.add(product_id, product)
+    
+    PRODUCT_METADATA_CACHE = current
+    CATALOG_ENTRIES = by_name
+    CATALOG_SKIPPED = skipped
+    CACHE_GENERATION += 1
+
+
+def load_product_metadata():
+    """
+    Load product metadata into memory cache on first use. Once loaded, an
+    expired cache is refreshed in a background thread while requests keep
+    using the current one.
+    """
     if METADATA_LOADED:
+        expired = time.time() - CACHE_REFRESHED_AT >= METADATA_REFRESH_SECONDS
+        if expired and _metadata_lock.acquire(blocking=False):
+            threading.Thread(target=refresh_product_metadata, daemon=True).start()
         return
     
+    # Concurrent cold requests share one load (and its failure, instead of
+    # each retrying the full scan in turn)
+    CATALOG_FLIGHT.do("catalog", _load_product_metadata_once)
+
+
+def _load_product_metadata_once():
+    global METADATA_LOADED, CACHE_REFRESHED_AT
+    
+    with _metadata_lock:
+        if METADATA_LOADED:
+            return
+        try:
+            logging.info(f"Loading product metadata from gs://{METADATA_BUCKET}/{catalog.SNAPSHOT_BLOB}")
+            entries, skipped, _ = catalog.load_catalog_state(_metadata_bucket())
+            _apply_catalog({entry['name']: entry for entry in entries}, skipped)
+            
+            CACHE_REFRESHED_AT = time.time()
+            METADATA_LOADED = True
+            logging.info(f"✓ Loaded metadata for {len(PRODUCT_METADATA_CACHE)} products")
+            
+        except Exception as e:
+            logging.error(f"Failed to load product metadata: {e}")
+
+
+def refresh_product_metadata():
+    """
+    Delta refresh: re-download only new/changed json/ blobs and evict deleted
+    ones. Runs with _metadata_lock already held by the caller and releases it.
+    On Cloud Run without always-on CPU this may only progress while requests
+    are being served, which is fine - the old cache stays valid meanwhile.
+    """
+    global CACHE_REFRESHED_AT
+    
     try:
-        logging.info(f"Loading product metadata from gs://{METADATA_BUCKET}/{METADATA_PREFIX}")
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(METADATA_BUCKET)
-        blobs = bucket.list_blobs(prefix=METADATA_PREFIX)
-        
-        count = 0
-        for blob in blobs:
-            if blob.name.endswith('.json'):
-                try:
-                    json_string = blob.download_as_string()
-                    json_data = json.loads(json_string)
-                    
-                    if 'structData' in json_data:
-                        product = json_data['structData']
-                        product_id = product.get('internalId') or json_data.get('id')
-                    else:
-                        product = json_data
-                        product_id = product.get('internalId') or product.get('id')
-                    
-                    if not product_id:
-                        logging.warning(f"No ID found in {blob.name}")
-                        continue
-                    
-                    image_urls = []
-                    if 'images' in product and isinstance(product['images'], list):
-                        for img in product['images']:
-                            if isinstance(img, dict):
-                                url = img.get('uri', img.get('url', ''))
-                                if url:
-                                    image_urls.append(url)
-                            elif isinstance(img, str):
-                                image_urls.append(img)
-                    elif 'uri' in product:
-                        image_urls = [product['uri']]
-                    elif 'imageUrl' in product:
-                        image_urls = [product['imageUrl']]
-                    
-                    PRODUCT_METADATA_CACHE[product_id] = {
-                        'title': product.get('title', 'Unknown'),
-                        'description': product.get('description', ''),
-                        'catalogNumber': product.get('catalogNumber', 'N/A'),
-                        'imageUrls': image_urls,
-                        'imageUrl': image_urls[0] if image_urls else '',
-                        'categories': product.get('categories', []),
-                        'available_time': product.get('available_time', '')
-                    }
-                    
-                    count += 1
-                        
-                except Exception as e:
-                    logging.warning(f"Failed to load metadata from {blob.name}: {e}")
+        by_name, skipped, changes = catalog.refresh_entries(
+            _metadata_bucket(), CATALOG_ENTRIES, CATALOG_SKIPPED
+        )
+        if changes:
+            _apply_catalog(by_name, skipped)
+            logging.info(f"✓ Metadata cache generation {CACHE_GENERATION}: {len(PRODUCT_METADATA_CACHE)} products")
+        if LOCAL_INDEX is not None:
+            refresh_local_index()
+    except Exception as e:
+        logging.warning(f"Metadata refresh failed, keeping current cache: {e}")
+    finally:
+        CACHE_REFRESHED_AT = time.time()
+        _metadata_lock.release()
+
+
+def catalog_cache_status():
+    """Freshness of the in-memory metadata cache."""
+    return {
+        "loaded": METADATA_LOADED,
+        "generation": CACHE_GENERATION,
+        "products": len(PRODUCT_METADATA_CACHE),
+        "age_seconds": round(time.time() - CACHE_REFRESHED_AT, 1) if METADATA_LOADED else None,
+        "refresh_seconds": METADATA_REFRESH_SECONDS
+    }
+
+
+def instance_status():
+    """Catalog freshness plus client/model initialization costs for GET probes."""
+    return {
+        "catalog": catalog_cache_status(),
+        "client_init_seconds": registry.init_timings(),
+        "query_embedding_cache": QUERY_EMBEDDING_CACHE.stats(),
+        "image_preprocessing": image_preprocess.stats(),
+        "warmup": warmup_status(),
+        "result_cursor_cache": RESULT_LIST_CACHE.stats(),
+        "single_flight": {
+            flight.name: flight.stats() for flight in (CATALOG_FLIGHT, EMBEDDING_FLIGHTS, NEIGHBOR_FLIGHTS)
+        },
+        "keyword_index_products": len(KEYWORD_INDEX) if KEYWORD_INDEX is not None else None,
+        "search_backend": {
+            "mode": SEARCH_BACKEND,
+            "local_index_kind": LOCAL_INDEX.kind if LOCAL_INDEX is not None else LOCAL_INDEX_KIND,
+            "local_index_size": len(LOCAL_INDEX) if LOCAL_INDEX is not None else None,
+            "local_index_generation": LOCAL_INDEX_GENERATION,
+            "local_index_pending_deltas": len(LOCAL_INDEX_DELTAS)
+        }
+    }
+
+
+# --- LOCAL VECTOR INDEX ---
+LOCAL_INDEX = None
+LOCAL_INDEX_GENERATION = 0
+LOCAL_INDEX_DELTAS = set()  # delta log entries replayed on top of the base generation
+_local_index_lock = threading.Lock()
+
+
+def load_local_index():
+    """
+    Load the persisted vector index once (base plus delta log),
+    bootstrapping it from Vector Search if missing.
+    """
+    global LOCAL_INDEX, LOCAL_INDEX_GENERATION, LOCAL_INDEX_DELTAS
+    
+    if LOCAL_INDEX is not None:
+        return LOCAL_INDEX
+    
+    with _local_index_lock:
+        if LOCAL_INDEX is None:
+            bucket = _metadata_bucket()
+            index, generation = vector_index.read_index(bucket)
+            if index is None:
+                index = bootstrap_local_index()
+            index, generation = _prepare_local_index(bucket, index, generation)
+            deltas = set()
+            vector_index.apply_deltas(bucket, index, deltas)
+            LOCAL_INDEX, LOCAL_INDEX_GENERATION, LOCAL_INDEX_DELTAS = index, generation, deltas
+            logging.info(f"✓ Local vector index ready: {len(index)} vectors (generation {generation}, {len(deltas)} deltas)")
+    return LOCAL_INDEX
+
+
+def refresh_local_index():
+    """
+    Apply delta log entries written by the ingest paths since the last
+    refresh, swapping in the base first if another instance compacted it.
+    Folds the log back into the base once enough deltas have accumulated.
+    """
+    global LOCAL_INDEX, LOCAL_INDEX_GENERATION, LOCAL_INDEX_DELTAS
+    
+    try:
+        bucket = _metadata_bucket()
+        if vector_index.index_generation(bucket) != LOCAL_INDEX_GENERATION:
+            index, generation = vector_index.read_index(bucket)
+            if index is not None:
+                index, generation = _prepare_local_index(bucket, index, generation)
+                deltas = set()
+                vector_index.apply_deltas(bucket, index, deltas)
+                LOCAL_INDEX, LOCAL_INDEX_GENERATION, LOCAL_INDEX_DELTAS = index, generation, deltas
+                logging.info(f"✓ Reloaded local vector index: {len(index)} vectors (generation {generation}, {len(deltas)} deltas)")
+                return
         
-        METADATA_LOADED = True
-        logging.info(f"✓ Loaded metadata for {count} products")
+        applied = vector_index.apply_deltas(bucket, LOCAL_INDEX, LOCAL_INDEX_DELTAS)
+        if applied:
+            logging.info(f"✓ Applied {applied} vector index delta(s): {len(LOCAL_INDEX)} vectors")
+        LOCAL_INDEX_GENERATION = vector_index.compact(bucket, LOCAL_INDEX, LOCAL_INDEX_GENERATION, LOCAL_INDEX_DELTAS)
+    except Exception as e:
+        logging.warning(f"Local vector index refresh failed: {e}")
+
+
+def _prepare_local_index(bucket, index, generation):
+    """
+    Convert/train the index to LOCAL_INDEX_KIND when needed and persist the
+    result, so later compactions keep the same kind. Returns the index and
+    the generation it corresponds to.
+    """
+    changed = generation == 0
+    if LOCAL_INDEX_KIND == vector_index.IVFIndex.kind:
+        if index.kind != vector_index.IVFIndex.kind:
+            index = vector_index.IVFIndex.from_index(index, nprobe=IVF_NPROBE)
+            changed = True
+        elif index.needs_training():
+            index.train()
+            changed = True
+        index.nprobe = IVF_NPROBE
+    
+    if changed:
+        try:
+            generation = vector_index.write_index(bucket, index, if_generation_match=generation)
+        except Exception as e:
+            logging.warning(f"Could not persist local vector index: {e}")
+    return index, generation
+
+
+def bootstrap_local_index():
+    """
+    Build the exact index by reading every catalog product's vector from
+    Vector Search. The result is persisted and then trusted by every
+    instance, so a missing/empty catalog or an empty result raises instead
+    of producing an empty index; the next request retries.
+    """
+    from google.cloud import aiplatform_v1
+    load_product_metadata()
+    if not METADATA_LOADED or not PRODUCT_METADATA_CACHE:
+        raise RuntimeError("Product catalog not loaded - not bootstrapping the local vector index")
+    
+    client = registry.match_service_client(API_ENDPOINT)
+    product_ids = sorted(PRODUCT_METADATA_CACHE)
+    index = vector_index.ExactIndex(capacity=max(1024, len(product_ids)))
+    
+    logging.info(f"Bootstrapping local vector index for {len(product_ids)} products")
+    for start in range(0, len(product_ids), READ_DATAPOINTS_BATCH):
+        response = client.read_index_datapoints(aiplatform_v1.ReadIndexDatapointsRequest(
+            index_endpoint=INDEX_ENDPOINT,
+            deployed_index_id=DEPLOYED_INDEX_ID,
+            ids=product_ids[start:start + READ_DATAPOINTS_BATCH]
+        ))
+        for datapoint in response.datapoints:
+            index.upsert(datapoint.datapoint_id, list(datapoint.feature_vector))
+    
+    if len(index) == 0:
+        raise RuntimeError(f"Vector Search returned no vectors for {len(product_ids)} products - not persisting an empty index")
+    return index
+
+
+def search_local_index(query_embedding, num_neighbors=30):
+    """Exact top-k search against the in-process index (same shape as search_similar_products)."""
+    index = load_local_index()
+    return [
+        {"id": datapoint_id, "distance": distance}
+        for datapoint_id, distance in index.search(query_embedding, num_neighbors)
+    ]
+
+
+def find_neighbors(query_embedding, num_neighbors=30):
+    """Nearest products from the configured SEARCH_BACKEND."""
+    return find_neighbors_batch([query_embedding], num_neighbors)[0]
+
+
+def find_neighbors_batch(query_embeddings, num_neighbors=30):
+    """Nearest products for several queries; the remote backend answers all of them in one request."""
+    if not query_embeddings:
+        return []
+    
+    # Identical concurrent queries share one backend call. Ranking annotates
+    # the candidate dicts in place, so every caller gets its own copies.
+    vectors = np.asarray(query_embeddings, dtype=np.float32)
+    key = (hashlib.sha1(vectors.tobytes()).hexdigest(), len(query_embeddings), num_neighbors)
+    results = NEIGHBOR_FLIGHTS.do(key, _find_neighbors_batch, query_embeddings, num_neighbors)
+    return [[dict(neighbor) for neighbor in query_results] for query_results in results]
+
+
+def _find_neighbors_batch(query_embeddings, num_neighbors):
+    if SEARCH_BACKEND == 'local':
+        with timing.span("vector_search"):
+            return [search_local_index(query_embedding, num_neighbors) for query_embedding in query_embeddings]
+    
+    with timing.span("vector_search"):
+        results = search_similar_products_batch(query_embeddings, num_neighbors)
+    if SEARCH_BACKEND == 'shadow':
+        for query_embedding, query_results in zip(query_embeddings, results):
+            compare_with_local_index(query_embedding, num_neighbors, query_results)
+    return results
+
+
+def compare_with_local_index(query_embedding, num_neighbors, remote_results):
+    """Shadow mode: log overlap and latency of the local index against the remote answer."""
+    try:
+        start = time.perf_counter()
+        local_results = search_local_index(query_embedding, num_neighbors)
+        local_ms = (time.perf_counter() - start) * 1000
         
+        remote_ids = [r['id'] for r in remote_results]
+        local_ids = [r['id'] for r in local_results]
+        overlap = len(set(remote_ids) & set(local_ids)) / max(1, len(remote_ids))
+        logging.info(
+            f"Shadow search: overlap@{num_neighbors}={overlap:.2f}, "
+            f"top1 {'match' if remote_ids[:1] == local_ids[:1] else 'differs'}, local {local_ms:.2f}ms"
+        )
     except Exception as e:
-        logging.error(f"Failed to load product metadata: {e}")
+        logging.warning(f"Shadow search failed: {e}")
+
+
+# --- INSTANCE WARM-UP ---
+_warmup_done = threading.Event()
+WARMUP_STATE = {"state": "off", "started_at": None, "seconds": None, "steps": {}}
+
+
+def open_vector_search_channel():
+    """Create the MatchService client and connect its gRPC channel (TLS + HTTP/2 setup)."""
+    client = registry.match_service_client(API_ENDPOINT)
+    channel = getattr(getattr(client, 'transport', None), 'grpc_channel', None)
+    if channel is not None:
+        import grpc
+        grpc.channel_ready_future(channel).result(timeout=WARMUP_CHANNEL_TIMEOUT_SECONDS)
+
+
+def resolve_embedding_model():
+    registry.embedding_model(EMBEDDING_MODEL_NAME)
+    from vertexai.vision_models import Image  # noqa: F401 - import cost paid here, not per request
+
+
+def warm_up():
+    """
+    Run the cold-path work of a first search: catalog (and local index when
+    used), embedding model, Vector Search channel. Steps share the same
+    locks/registry as requests, so nothing runs twice; a failed step is
+    recorded and left for requests to retry.
+    """
+    steps = [("catalog", load_product_metadata), ("model", resolve_embedding_model)]
+    if SEARCH_BACKEND != 'remote':
+        steps.append(("local_index", load_local_index))
+    if SEARCH_BACKEND != 'local':
+        steps.append(("vector_search_channel", open_vector_search_channel))
+    
+    start = time.perf_counter()
+    failed = False
+    for name, step in steps:
+        step_start = time.perf_counter()
+        try:
+            with timing.span(f"warmup_{name}"):
+                step()
+            WARMUP_STATE["steps"][name] = {"seconds": round(time.perf_counter() - step_start, 3)}
+        except Exception as e:
+            failed = True
+            WARMUP_STATE["steps"][name] = {"error": str(e)}
+            logging.warning(f"⚠ Warm-up step {name} failed: {e}")
+    
+    if not METADATA_LOADED:
+        failed = True
+    WARMUP_STATE["seconds"] = round(time.perf_counter() - start, 3)
+    WARMUP_STATE["state"] = "degraded" if failed else "ready"
+    _warmup_done.set()
+    logging.info(f"{'⚠' if failed else '✓'} Warm-up {WARMUP_STATE['state']} in {WARMUP_STATE['seconds']}s")
+
+
+def start_warmup():
+    """
+    Start warm_up() on a daemon thread. Without always-allocated CPU the
+    platform may throttle it between requests; startup CPU boost covers the
+    boot window.
+    """
+    WARMUP_STATE.update(state="running", started_at=time.time())
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
+
+def wait_for_warmup():
+    """Block a request while warm-up is running (bounded by WARMUP_WAIT_SECONDS)."""
+    if WARMUP_STATE["state"] == "running":
+        with timing.span("warmup_wait"):
+            _warmup_done.wait(WARMUP_WAIT_SECONDS)
+
+
+def warmup_status():
+    return dict(WARMUP_STATE, enabled=WARMUP_ON_START)
+
+
+def readiness():
+    """
+    (body, status) for readiness probes: 200 once warm, 503 while warming or
+    if the catalog is missing. Without a warm-up in flight (disabled, or
+    finished degraded) the probe loads the catalog itself, so a probe-only
+    instance still becomes ready.
+    """
+    state = WARMUP_STATE["state"]
+    if state in ("off", "degraded"):
+        load_product_metadata()
+        ready = METADATA_LOADED
+    else:
+        ready = state == "ready"
+    return {"ready": ready, "warmup": warmup_status(), "products": len(PRODUCT_METADATA_CACHE)}, 200 if ready else 503
 
 
 @functions_framework.http
+@timing.timed_handler("find_product")
 def find_product(request):
-    """HTTP Cloud Function for intelligent product search."""
+    """
+    HTTP Cloud Function for intelligent product search.
+    POST {"cursor": ...} serves the next page from the instance that ran the
+    search; other instances answer 410 and the client falls back to
+    {"text_query"/"image_base64": ..., "offset": N}.
+    """
     
     frontend_url = "*"
-    headers = {'Access-Control-Allow-Origin': frontend_url}
+    headers = {
+        'Access-Control-Allow-Origin': frontend_url,
+        'Access-Control-Expose-Headers': 'Server-Timing, X-Catalog-Generation, X-Catalog-Age'
+    }
     
     if request.method == 'OPTIONS':
         headers.update({
-            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Methods': 'GET, POST',
             'Access-Control-Allow-Headers': 'Content-Type',
             'Access-Control-Max-Age': '3600'
         })
         return ('', 204, headers)
 
+    if request.method == 'GET':
+        if timing.debug_requested(request):
+            return (json.dumps(timing.snapshot()), 200, headers)
+        if 'ready' in request.args:
+            body, status = readiness()
+            return (json.dumps(body), status, headers)
+        return (json.dumps(instance_status()), 200, headers)
+
     request_json = request.get_json(silent=True)
     if not request_json:
         return (json.dumps({'error': 'Invalid JSON'}), 400, headers)
@@ -126,6 +536,16 @@ def find_product(request):
     text_query = request_json.get('text_query')
     num_results = int(request_json.get('num_results', 20))
     offset = int(request_json.get('offset', 0))
+    cursor = request_json.get('cursor')
+
+    if cursor:
+        return serve_cursor_page(cursor, num_results, headers)
+
+    # Searches arriving during instance warm-up wait for it rather than redo it
+    wait_for_warmup()
+    
+    if 'queries' in request_json:
+        return find_products_batch(request_json, headers)
 
     if not image_base64 and not text_query:
         return (json.dumps({'error': 'Must provide image_base64 or text_query'}), 400, headers)
@@ -135,78 +555,34 @@ def find_product(request):
     logging.info(f"Mode: {search_mode}, Query: '{text_query}', Offset: {offset}")
 
     try:
-        load_product_metadata()
-        
-        # Generate embedding
-        if image_base64:
-            logging.info("Generating image embedding...")
-            query_embedding = generate_image_embedding(image_base64, text_query)
-        else:
-            logging.info("Generating text embedding...")
-            query_embedding = generate_text_embedding(text_query)
-        
-        # Search Vector Search
-        similar_products = search_similar_products(query_embedding, MAX_CANDIDATES)
+        with timing.span("metadata"):
+            load_product_metadata()
         
         # Apply intelligent filtering
         if search_mode == 'text':
-            filtered_products = filter_text_search_smart(similar_products, text_query)
+            candidates = hybrid_text_candidates(text_query)
+            with timing.span("filter"):
+                filtered_products = rank_candidates(search_mode, candidates, text_query)
         else:
-            filtered_products = filter_image_search_smart(similar_products)
-            
-            # NEW: If image search returns 0 results, get at least the best 1
-            if len(filtered_products) == 0:
-                logging.info("No results above threshold - returning best match")
-                filtered_products = filter_image_search_fallback(similar_products)
-                
-                if len(filtered_products) > 0:
-                    filtered_products[0]['is_low_confidence'] = True
+            # Generate embedding and search Vector Search
+            query_embedding = get_query_embedding(image_base64, text_query)
+            similar_products = find_neighbors(query_embedding, MAX_CANDIDATES)
+            with timing.span("filter"):
+                filtered_products = rank_candidates(search_mode, similar_products)
         
         logging.info(f"=== AFTER FILTERING: {len(filtered_products)} products ===")
         
-        # Pagination
-        paginated_products = filtered_products[offset:offset + num_results]
-        has_more = len(filtered_products) > (offset + num_results)
+        cache_status = catalog_cache_status()
+        headers['X-Catalog-Generation'] = str(cache_status['generation'])
+        headers['X-Catalog-Age'] = str(cache_status['age_seconds'])
         
-        # Enrich results
-        results = []
-        for product in paginated_products:
-            product_id = product['id']
-            metadata = PRODUCT_METADATA_CACHE.get(product_id, {})
-            
-            match_percentage = product.get('match_score', 0)
-            quality = get_match_quality_from_percentage(match_percentage)
-            
-            image_urls = []
-            if 'imageUrls' in metadata and isinstance(metadata['imageUrls'], list):
-                image_urls = metadata['imageUrls']
-            elif 'imageUrl' in metadata and metadata['imageUrl']:
-                image_urls = [metadata['imageUrl']]
-            
-            results.append({
-                "id": product_id,
-                "title": metadata.get('title', 'Unknown'),
-                "catalogNumber": metadata.get('catalogNumber', 'N/A'),
-                "imageUrl": image_urls[0] if image_urls else '',
-                "imageUrls": image_urls,
-                "description": metadata.get('description', ''),
-                "categories": metadata.get('categories', []),
-                "similarity_percentage": match_percentage,
-                "match_quality": quality,
-                "raw_distance": round(product['distance'], 4),
-                "search_mode": search_mode,
-                "is_low_confidence": product.get('is_low_confidence', False)
-            })
-        
-        message = f"Found {len(filtered_products)} matching product(s)" if results else "No matching products found"
+        # Keep the ranked list so later pages skip embedding and search
+        list_id = secrets.token_urlsafe(12)
+        RESULT_LIST_CACHE.put(list_id, {"products": filtered_products, "search_mode": search_mode})
         
-        return (json.dumps({
-            "results": results,
-            "message": message,
-            "total_matches": len(filtered_products),
-            "has_more": has_more,
-            "search_mode": search_mode
-        }), 200, headers)
+        with timing.span("enrich"):
+            page = build_page(filtered_products, search_mode, offset, num_results, list_id)
+        return (json.dumps(page), 200, headers)
 
     except Exception as e:
         error_trace = traceback.format_exc()
@@ -214,49 +590,315 @@ def find_product(request):
         return (json.dumps({"message": "Search failed.", "error": str(e)}), 500, headers)
 
 
-def filter_text_search_smart(products, text_query):
-    """Smart filtering for text searches with keyword matching."""
-    if not text_query:
-        return []
+def rank_candidates(search_mode, candidates, text_query=None):
+    """Filter and order search candidates for one query."""
+    if search_mode == 'text':
+        return filter_text_search_smart(candidates, text_query)
     
-    text_query = text_query.strip().lower()
-    keywords = text_query.split()
+    filtered_products = filter_image_search_smart(candidates)
     
-    filtered = []
+    # NEW: If image search returns 0 results, get at least the best 1
+    if len(filtered_products) == 0:
+        logging.info("No results above threshold - returning best match")
+        filtered_products = filter_image_search_fallback(candidates)
+        
+        if len(filtered_products) > 0:
+            filtered_products[0]['is_low_confidence'] = True
+    return filtered_products
+
+
+def find_products_batch(request_json, headers):
+    """
+    Batch search, e.g. a whole shelf during stock-taking:
+      {"queries": [{"image_base64": ...} or {"text_query": ...}, ...], "num_results": N}
+    All queries are embedded concurrently and their neighbours come from one
+    multi-query FindNeighborsRequest; each is then ranked like a single
+    search. Returns {"results": [...]} in query order, each entry shaped like
+    a single-search response (with its own cursor), or {"error": ...} for a
+    query that failed without failing the rest.
+    """
+    queries = request_json.get('queries')
+    num_results = int(request_json.get('num_results', 20))
     
-    for product in products:
+    if not isinstance(queries, list) or not queries:
+        return (json.dumps({'error': 'queries must be a non-empty list'}), 400, headers)
+    if len(queries) > BATCH_MAX_QUERIES:
+        return (json.dumps({'error': f'At most {BATCH_MAX_QUERIES} queries per batch'}), 400, headers)
+    if not all(isinstance(q, dict) and (q.get('image_base64') or q.get('text_query')) for q in queries):
+        return (json.dumps({'error': 'Each query must provide image_base64 or text_query'}), 400, headers)
+    
+    logging.info(f"=== BATCH SEARCH START: {len(queries)} queries ===")
+    
+    try:
+        with timing.span("metadata"):
+            load_product_metadata()
+        
+        # Embed every query concurrently (cached embeddings return immediately)
+        with ThreadPoolExecutor(max_workers=min(QUERY_EMBED_WORKERS, len(queries))) as pool:
+            futures = [
+                pool.submit(timing.bind(get_query_embedding), q.get('image_base64'), q.get('text_query'))
+                for q in queries
+            ]
+            embeddings, errors = [], {}
+            for i, future in enumerate(futures):
+                try:
+                    embeddings.append(future.result())
+                except Exception as e:
+                    errors[i] = str(e)
+                    embeddings.append(None)
+        
+        embedded = [i for i in range(len(queries)) if i not in errors]
+        neighbors = dict(zip(embedded, find_neighbors_batch([embeddings[i] for i in embedded], MAX_CANDIDATES)))
+        
+        # Lexical-only candidates of every text query share one vector read
+        lexical = {i: lexical_candidates(queries[i]['text_query']) for i in embedded if not queries[i].get('image_base64')}
+        lexical_vectors = None
+        missing = set()
+        for i, matches in lexical.items():
+            missing.update(lexical_only_ids(neighbors[i], matches))
+        try:
+            with timing.span("rescore"):
+                lexical_vectors = datapoint_vectors(sorted(missing))
+        except Exception as e:
+            logging.warning(f"Batched lexical rescore failed, scoring per query: {e}")
+        
+        results = []
+        for i, query in enumerate(queries):
+            if i in errors:
+                results.append({"error": errors[i]})
+                continue
+            search_mode = 'image' if query.get('image_base64') else 'text'
+            try:
+                candidates = neighbors[i]
+                if search_mode == 'text':
+                    candidates = merge_lexical_candidates(embeddings[i], candidates, lexical[i], lexical_vectors)
+                with timing.span("filter"):
+                    filtered_products = rank_candidates(search_mode, candidates, query.get('text_query'))
+                list_id = secrets.token_urlsafe(12)
+                RESULT_LIST_CACHE.put(list_id, {"products": filtered_products, "search_mode": search_mode})
+                with timing.span("enrich"):
+                    results.append(build_page(filtered_products, search_mode, 0, num_results, list_id))
+            except Exception as e:
+                logging.error(f"Batch query {i} failed: {e}")
+                results.append({"error": str(e)})
+        
+        logging.info(f"=== BATCH SEARCH DONE: {len(results) - sum('error' in r for r in results)}/{len(results)} ok ===")
+        
+        cache_status = catalog_cache_status()
+        headers['X-Catalog-Generation'] = str(cache_status['generation'])
+        headers['X-Catalog-Age'] = str(cache_status['age_seconds'])
+        
+        return (json.dumps({"results": results, "count": len(results)}), 200, headers)
+    
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        logging.error(f"Batch search failed: {e}\n{error_trace}")
+        return (json.dumps({"message": "Search failed.", "error": str(e)}), 500, headers)
+
+
+def encode_cursor(list_id, offset):
+    return base64.urlsafe_b64encode(json.dumps([list_id, offset]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (list_id, offset); raises ValueError for malformed cursors."""
+    try:
+        list_id, offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(list_id), int(offset)
+    except Exception as e:
+        raise ValueError(f"Malformed cursor: {e}")
+
+
+def serve_cursor_page(cursor, num_results, headers):
+    """Serve a later page straight from a cached ranked list - no model or index calls."""
+    try:
+        list_id, offset = decode_cursor(cursor)
+    except ValueError as e:
+        return (json.dumps({"error": str(e)}), 400, headers)
+    
+    cached = RESULT_LIST_CACHE.get(list_id)
+    if cached is None:
+        return (json.dumps({
+            "error": "Cursor expired",
+            "message": "Search results expired, please search again."
+        }), 410, headers)
+    
+    logging.info(f"Cursor page: list {list_id}, offset {offset}")
+    with timing.span("enrich"):
+        page = build_page(cached['products'], cached['search_mode'], offset, num_results, list_id)
+    return (json.dumps(page), 200, headers)
+
+
+def build_page(filtered_products, search_mode, offset, num_results, list_id):
+    """Slice and enrich one page of a ranked list; includes the cursor for the next page."""
+    paginated_products = filtered_products[offset:offset + num_results]
+    has_more = len(filtered_products) > (offset + num_results)
+    
+    # Enrich results
+    results = []
+    for product in paginated_products:
         product_id = product['id']
         metadata = PRODUCT_METADATA_CACHE.get(product_id, {})
         
-        title = metadata.get('title', '').lower()
-        description = metadata.get('description', '').lower()
-        categories = ' '.join(metadata.get('categories', [])).lower()
+        match_percentage = product.get('match_score', 0)
+        quality = get_match_quality_from_percentage(match_percentage)
         
-        exact_matches = 0
+        image_urls = []
+        if 'imageUrls' in metadata and isinstance(metadata['imageUrls'], list):
+            image_urls = metadata['imageUrls']
+        elif 'imageUrl' in metadata and metadata['imageUrl']:
+            image_urls = [metadata['imageUrl']]
         
-        for keyword in keywords:
-            if keyword in title:
-                exact_matches += 2
-            elif keyword in description:
-                exact_matches += 1
-            elif keyword in categories:
-                exact_matches += 1
-        
-        if exact_matches == 0:
+        results.append({
+            "id": product_id,
+            "title": metadata.get('title', 'Unknown'),
+            "catalogNumber": metadata.get('catalogNumber', 'N/A'),
+            "imageUrl": image_urls[0] if image_urls else '',
+            "imageUrls": image_urls,
+            "description": metadata.get('description', ''),
+            "categories": metadata.get('categories', []),
+            "similarity_percentage": match_percentage,
+            "match_quality": quality,
+            "raw_distance": round(product['distance'], 4),
+            "search_mode": search_mode,
+            "is_low_confidence": product.get('is_low_confidence', False)
+        })
+    
+    message = f"Found {len(filtered_products)} matching product(s)" if results else "No matching products found"
+    
+    return {
+        "results": results,
+        "message": message,
+        "total_matches": len(filtered_products),
+        "has_more": has_more,
+        "cursor": encode_cursor(list_id, offset + num_results) if has_more else None,
+        "search_mode": search_mode
+    }
+
+
+def hybrid_text_candidates(text_query):
+    """
+    Candidate pool for a text query: vector neighbours of the query embedding
+    plus the top lexical matches from the whole catalog, retrieved in parallel.
+    Lexical-only candidates get their vector distance from the local index if
+    loaded, otherwise from one read_index_datapoints round trip (0 if the
+    product has no indexed vector yet).
+    """
+    def _vector_search():
+        query_embedding = get_query_embedding(None, text_query)
+        return query_embedding, find_neighbors(query_embedding, MAX_CANDIDATES)
+    
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        vector_future = pool.submit(timing.bind(_vector_search))
+        lexical = lexical_candidates(text_query)
+        query_embedding, candidates = vector_future.result()
+    
+    return merge_lexical_candidates(query_embedding, candidates, lexical)
+
+
+def lexical_candidates(text_query):
+    """Top keyword matches from the whole catalog: [(product_id, score, tokens matched)]."""
+    if KEYWORD_INDEX is None:
+        return []
+    with timing.span("lexical"):
+        return KEYWORD_INDEX.search(text_query, LEXICAL_CANDIDATES)
+
+
+def lexical_only_ids(candidates, lexical):
+    """Lexical matches that are not already among the vector candidates."""
+    seen = {product['id'] for product in candidates}
+    return [product_id for product_id, _, _ in lexical if product_id not in seen]
+
+
+def merge_lexical_candidates(query_embedding, candidates, lexical, vectors=None):
+    """
+    Append lexical-only matches to the vector candidates, with their vector
+    distance. `vectors` ({product_id: vector}, as from datapoint_vectors) may
+    already hold them; otherwise they are read here.
+    """
+    missing = lexical_only_ids(candidates, lexical)
+    merged = list(candidates)
+    if missing:
+        if vectors is None:
+            with timing.span("rescore"):
+                vectors = datapoint_vectors(missing)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        merged += [
+            {"id": product_id, "distance": float(vectors[product_id] @ query) if product_id in vectors else 0.0}
+            for product_id in missing
+        ]
+    
+    logging.info(f"Hybrid candidates: {len(candidates)} vector, {len(lexical)} lexical, {len(merged)} merged")
+    return merged
+
+
+def datapoint_vectors(product_ids):
+    """{product_id: vector} for specific indexed products (absent ids are left out)."""
+    if not product_ids:
+        return {}
+    if LOCAL_INDEX is not None:
+        vectors = {pid: LOCAL_INDEX.get_vector(pid) for pid in product_ids}
+    else:
+        from google.cloud import aiplatform_v1
+        client = registry.match_service_client(API_ENDPOINT)
+        vectors = {}
+        for start in range(0, len(product_ids), READ_DATAPOINTS_BATCH):
+            response = client.read_index_datapoints(aiplatform_v1.ReadIndexDatapointsRequest(
+                index_endpoint=INDEX_ENDPOINT,
+                deployed_index_id=DEPLOYED_INDEX_ID,
+                ids=product_ids[start:start + READ_DATAPOINTS_BATCH]
+            ))
+            for datapoint in response.datapoints:
+                vectors[datapoint.datapoint_id] = np.asarray(datapoint.feature_vector, dtype=np.float32)
+    return {pid: vector for pid, vector in vectors.items() if vector is not None}
+
+
+def filter_text_search_smart(products, text_query):
+    """
+    Smart filtering for text searches with keyword matching.
+    Keyword relevance is BM25F from KEYWORD_INDEX, expressed as a percentage
+    of the best keyword score anywhere in the catalog for this query.
+    Products without any keyword match are dropped; the rest are ordered
+    title matches (every query token in the title) first, then by reciprocal
+    rank fusion of their keyword rank and vector rank.
+    """
+    if not text_query or KEYWORD_INDEX is None:
+        return []
+    
+    catalog_matches = KEYWORD_INDEX.score(text_query)
+    if not catalog_matches:
+        return []
+    best_keyword_score = max(score for score, _ in catalog_matches.values())
+    title_matches = KEYWORD_INDEX.title_matches(text_query)
+    
+    filtered = []
+    
+    for product in products:
+        keyword_score, matched_keywords = catalog_matches.get(product['id'], (0.0, 0))
+        if keyword_score <= 0:
             continue
         
-        keyword_percentage = min(100, (exact_matches / len(keywords)) * 100)
+        keyword_percentage = min(100, keyword_score / best_keyword_score * 100)
         vector_similarity = calculate_similarity_from_distance(product['distance'])
         
         combined_score = (keyword_percentage * 0.7) + (vector_similarity * 0.3)
         
         product['match_score'] = round(combined_score, 1)
-        product['keyword_matches'] = exact_matches
-        product['sort_score'] = exact_matches * 1000 + vector_similarity
+        product['keyword_matches'] = matched_keywords
+        product['keyword_score'] = keyword_score
         
         filtered.append(product)
     
-    filtered.sort(key=lambda x: x['sort_score'], reverse=True)
+    keyword_order = sorted(filtered, key=lambda x: (-x['keyword_score'], x['id']))
+    vector_order = sorted(filtered, key=lambda x: (-x['distance'], x['id']))
+    for rank, product in enumerate(keyword_order, 1):
+        product['sort_score'] = 1 / (RRF_K + rank)
+    for rank, product in enumerate(vector_order, 1):
+        product['sort_score'] += 1 / (RRF_K + rank)
+    for product in filtered:
+        del product['keyword_score']
+    
+    filtered.sort(key=lambda x: (x['id'] not in title_matches, -x['sort_score'], x['id']))
     
     return filtered
 
@@ -323,18 +965,68 @@ def get_match_quality_from_percentage(percentage):
         return 'poor'
 
 
+def normalize_query(text):
+    """Cache key form of a text query: trimmed, single-spaced, case-folded."""
+    return ' '.join(text.split()).casefold()
+
+
+def get_query_embedding(image_base64=None, text_query=None):
+    """Embed a search query, serving repeats from QUERY_EMBEDDING_CACHE."""
+    if EMBEDDING_CACHE_TIER:
+        EMBEDDING_CACHE_TIER.load_into(QUERY_EMBEDDING_CACHE)
+    
+    if image_base64:
+        image_bytes = base64.b64decode(image_base64)
+        cache_key = f"image:{image_preprocess.PREPROCESS_TAG}:{hashlib.sha256(image_bytes).hexdigest()}"
+    else:
+        text_query = normalize_query(text_query)
+        cache_key = f"text:{text_query}"
+    
+    embedding = QUERY_EMBEDDING_CACHE.get(cache_key)
+    if embedding is not None:
+        logging.info(f"Query embedding cache hit: {cache_key[:40]}")
+        return embedding
+    
+    def _embed():
+        if image_base64:
+            logging.info("Generating image embedding...")
+            embedding = embed_image_bytes(image_bytes)
+        else:
+            logging.info("Generating text embedding...")
+            embedding = generate_text_embedding(text_query)
+        
+        embedding = list(embedding)
+        QUERY_EMBEDDING_CACHE.put(cache_key, embedding)
+        if EMBEDDING_CACHE_TIER:
+            EMBEDDING_CACHE_TIER.note_write(QUERY_EMBEDDING_CACHE)
+        return embedding
+    
+    # The same query arriving while its embedding is in flight waits for it
+    return EMBEDDING_FLIGHTS.do(cache_key, _embed)
+
+
 def generate_image_embedding(image_base64, contextual_text=None):
     """Generate IMAGE-ONLY embedding."""
+    return embed_image_bytes(base64.b64decode(image_base64))
+
+
+def embed_image_bytes(image_bytes):
+    """Generate IMAGE-ONLY embedding from raw image bytes."""
+    from vertexai.vision_models import Image as VertexImage
     try:
-        model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
-        image_bytes = base64.b64decode(image_base64)
+        model = registry.embedding_model(EMBEDDING_MODEL_NAME)
+        with timing.span("preprocess"):
+            image_bytes = image_preprocess.prepare_for_embedding(image_bytes)
         image = VertexImage(image_bytes=image_bytes)
         
-        embeddings = model.get_embeddings(
-            image=image,
-            contextual_text=None,
-            dimension=512
-        )
+        start = time.perf_counter()
+        with timing.span("embedding"):
+            embeddings = model.get_embeddings(
+                image=image,
+                contextual_text=None,
+                dimension=512
+            )
+        image_preprocess.record_model_call(time.perf_counter() - start, len(image_bytes))
         
         return embeddings.image_embedding
         
@@ -346,12 +1038,13 @@ def generate_image_embedding(image_base64, contextual_text=None):
 def generate_text_embedding(text):
     """Generate embedding for text."""
     try:
-        model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
+        model = registry.embedding_model(EMBEDDING_MODEL_NAME)
         
-        embeddings = model.get_embeddings(
-            contextual_text=text,
-            dimension=512
-        )
+        with timing.span("embedding"):
+            embeddings = model.get_embeddings(
+                contextual_text=text,
+                dimension=512
+            )
         
         return embeddings.text_embedding
         
@@ -362,40 +1055,53 @@ def generate_text_embedding(text):
 
 def search_similar_products(query_embedding, num_neighbors=30):
     """Search for similar products using Vector Search."""
+    return search_similar_products_batch([query_embedding], num_neighbors)[0]
+
+
+def search_similar_products_batch(query_embeddings, num_neighbors=30):
+    """One FindNeighborsRequest for several query embeddings; results in query order."""
+    from google.cloud import aiplatform_v1
     try:
-        client_options = {"api_endpoint": API_ENDPOINT}
-        vector_search_client = aiplatform_v1.MatchServiceClient(
-            client_options=client_options
-        )
-        
-        datapoint = aiplatform_v1.IndexDatapoint(
-            feature_vector=query_embedding
-        )
+        vector_search_client = registry.match_service_client(API_ENDPOINT)
         
-        query = aiplatform_v1.FindNeighborsRequest.Query(
-            datapoint=datapoint,
-            neighbor_count=num_neighbors
-        )
+        # Query datapoint IDs are the positions, so answers map back to queries
+        queries = [
+            aiplatform_v1.FindNeighborsRequest.Query(
+                datapoint=aiplatform_v1.IndexDatapoint(
+                    datapoint_id=str(i),
+                    feature_vector=query_embedding
+                ),
+                neighbor_count=num_neighbors
+            )
+            for i, query_embedding in enumerate(query_embeddings)
+        ]
         
         find_neighbors_request = aiplatform_v1.FindNeighborsRequest(
             index_endpoint=INDEX_ENDPOINT,
             deployed_index_id=DEPLOYED_INDEX_ID,
-            queries=[query],
+            queries=queries,
             return_full_datapoint=False
         )
         
         response = vector_search_client.find_neighbors(find_neighbors_request)
         
-        results = []
-        if response.nearest_neighbors:
-            for neighbor in response.nearest_neighbors[0].neighbors:
-                results.append({
+        results = [[] for _ in query_embeddings]
+        for position, nearest in enumerate(response.nearest_neighbors):
+            query_index = int(nearest.id) if nearest.id else position
+            results[query_index] = [
+                {
                     "id": neighbor.datapoint.datapoint_id,
                     "distance": float(neighbor.distance)
-                })
+                }
+                for neighbor in nearest.neighbors
+            ]
         
         return results
         
     except Exception as e:
         logging.error(f"Vector Search failed: {e}")
         raise
+
+
+if WARMUP_ON_START:
+    start_warmup()
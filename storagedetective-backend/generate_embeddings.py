@@ -0,0 +1,315 @@
+# generate_embeddings.py - BULK RE-INDEX WITH IMAGE-ONLY EMBEDDINGS
+"""
+Re-embed every product in the catalog and upsert the vectors into Vector Search.
+
+Products are streamed from the catalog snapshot (or a json/ scan when there
+is none) and embedded with the same code as add_product_embedding: all of a
+product's images are downloaded and embedded concurrently, unchanged photos
+reuse their stored per-image embeddings, and the vectors are averaged with
+np.mean. Up to --workers products are in flight at once; vectors are upserted
+in batches of --batch-size.
+
+Every uploaded batch is appended to a local checkpoint file, so rerunning
+after a crash skips products that already reached the index (--restart
+ignores it). Each indexed product also gets the same index_state marker
+add_product_embedding writes, so a later metadata-only rewrite of its JSON
+does not re-embed it. A throughput report is printed at the end.
+
+    python generate_embeddings.py --yes
+    python generate_embeddings.py --dry-run --products 500
+
+--dry-run runs the whole pipeline against the in-process fakes of
+benchmarks/fakes.py (bucket, image downloads, embedding model, index) and
+touches no GCP resources; unless --checkpoint is given it checkpoints to a
+fresh temporary file, so every dry run starts from scratch. The
+addProductEmbedding requirements must be installed either way.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'addProductEmbedding'))
+
+import catalog  # noqa: E402
+import embedding_store  # noqa: E402
+import image_pipeline  # noqa: E402
+import image_preprocess  # noqa: E402
+import ingest_state  # noqa: E402
+import registry  # noqa: E402
+import vector_index  # noqa: E402
+
+PROJECT_ID = "storagedetective"
+PROJECT_NUMBER = "325488595361"
+LOCATION = "us-central1"
+SOURCE_BUCKET = "storagedetective.firebasestorage.app"
+EMBEDDING_DIMENSION = 512
+EMBEDDING_MODEL_NAME = "multimodalembedding@001"
+
+# Index ID
+INDEX_ID = "8707413011381354496"
+INDEX_NAME = f"projects/{PROJECT_NUMBER}/locations/{LOCATION}/indexes/{INDEX_ID}"
+
+BATCH_SIZE = 100
+DEFAULT_WORKERS = 4
+DEFAULT_CHECKPOINT = "reindex_checkpoint.jsonl"
+
+
+# --- CHECKPOINT ---
+class Checkpoint:
+    """Append-only JSONL of product IDs whose vectors reached the index."""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.done = set()
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)['id'])
+                    except (ValueError, KeyError):
+                        pass  # torn last line from a crash
+        print(f"Checkpoint {path}: {len(self.done)} product(s) already indexed")
+
+    def record(self, product_ids):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for product_id in product_ids:
+                f.write(json.dumps({'id': product_id}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(product_ids)
+
+
+# --- PIPELINE ---
+class CountingModel:
+    """Wraps the embedding model to count the calls actually made."""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_embeddings(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+        return self.model.get_embeddings(**kwargs)
+
+
+def iter_catalog_entries(bucket):
+    found = yield from catalog.iter_snapshot_entries(bucket)
+    if not found:
+        print("No catalog snapshot - scanning json/")
+        yield from catalog.iter_scanned_entries(bucket)
+
+
+def embed_product(model, store, entry):
+    """
+    Averaged embedding for one catalog entry (None if no image could be
+    embedded), with the (fingerprint, source generation) of its index_state
+    marker. As in add_product_embedding, a partly embedded product records
+    only the images that made it in and no generation, so it is retried.
+    """
+    product = entry['product']
+    embeddings, failures = image_pipeline.embed_images(
+        model, product['imageUrls'], EMBEDDING_DIMENSION, store=store
+    )
+    vector = image_pipeline.average_embeddings(embeddings) if embeddings else None
+    uris = ingest_state.embedded_uris(product['imageUrls'], failures)
+    marker = (
+        ingest_state.fingerprint(uris, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION),
+        None if failures else entry.get('generation')
+    )
+    return product['id'], vector, len(embeddings), len(failures), marker
+
+
+class Reindexer:
+    def __init__(self, bucket, model, index, checkpoint, workers, batch_size):
+        self.bucket = bucket
+        self.model = CountingModel(model)
+        self.store = embedding_store.shared_store(bucket, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION)
+        self.index = index
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch = {}
+        self.markers = {}
+        self.counts = dict.fromkeys(
+            ('indexed', 'resumed', 'no_images', 'failed', 'images', 'image_failures'), 0
+        )
+
+    def run(self, limit=None):
+        start = time.time()
+        seen = set()
+        in_flight = set()
+        submitted = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reindex") as pool:
+            for entry in iter_catalog_entries(self.bucket):
+                product = entry['product']
+                if product['id'] in seen:
+                    continue
+                seen.add(product['id'])
+                if product['id'] in self.checkpoint.done:
+                    self.counts['resumed'] += 1
+                    continue
+                if not product['imageUrls']:
+                    self.counts['no_images'] += 1
+                    continue
+                if limit is not None and submitted >= limit:
+                    break
+
+                submitted += 1
+                in_flight.add(pool.submit(embed_product, self.model, self.store, entry))
+                if len(in_flight) >= self.workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._collect(done)
+
+            self._collect(in_flight)
+        self._flush()
+        return time.time() - start
+
+    def _collect(self, futures):
+        for future in futures:
+            try:
+                product_id, vector, images, image_failures, marker = future.result()
+            except Exception as e:
+                print(f"  ✗ Failed: {e}")
+                self.counts['failed'] += 1
+                continue
+            self.counts['images'] += images
+            self.counts['image_failures'] += image_failures
+            if vector is None:
+                print(f"  ✗ No embeddings for {product_id}")
+                self.counts['failed'] += 1
+                continue
+            self.batch[product_id] = vector
+            self.markers[product_id] = marker
+            if len(self.batch) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, {}
+        markers = {product_id: self.markers.pop(product_id) for product_id in batch}
+        try:
+            self.index.upsert_datapoints(datapoints=[
+                {"datapoint_id": product_id, "feature_vector": vector}
+                for product_id, vector in batch.items()
+            ])
+        except Exception as e:
+            print(f"  ✗ Batch upsert of {len(batch)} failed (will be retried on rerun): {e}")
+            self.counts['failed'] += len(batch)
+            return
+        self.checkpoint.record(batch)
+        self.counts['indexed'] += len(batch)
+        print(f"  ✓ Upserted batch of {len(batch)} ({self.counts['indexed']} indexed this run)")
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(
+                lambda item: ingest_state.write_marker(self.bucket, item[0], item[1][0], source_generation=item[1][1]),
+                markers.items()
+            ))
+        try:
+            vector_index.update_persisted_index(self.bucket, upserts=batch)
+        except Exception as e:
+            print(f"  ⚠ Local vector index update failed: {e}")
+
+    def report(self, elapsed):
+        counts = self.counts
+        elapsed = max(elapsed, 1e-9)
+        print("\n" + "="*60)
+        print(f"SUMMARY: {counts['indexed']} indexed, {counts['failed']} failed, "
+              f"{counts['resumed']} skipped from checkpoint, {counts['no_images']} without images")
+        print(f"Images: {counts['images']} embedded/reused, {counts['image_failures']} failed")
+        print(f"Model calls: {self.model.calls} "
+              f"(stored image embeddings reused: {self.store.hits})")
+        preprocessing = image_preprocess.stats()
+        if preprocessing['images']:
+            print(f"Preprocessing: {preprocessing['bytes_saved'] / 1e6:.1f}MB saved, "
+                  f"{preprocessing['avg_bytes_in'] / 1024:.0f}KB → {preprocessing['avg_bytes_out'] / 1024:.0f}KB "
+                  f"per image in {preprocessing['avg_preprocess_ms']}ms; model call {preprocessing['avg_model_ms']}ms avg")
+        print(f"Elapsed: {elapsed:.1f}s - {counts['indexed'] / elapsed:.2f} products/s, "
+              f"{counts['images'] / elapsed:.2f} images/s")
+        print("="*60 + "\n")
+
+
+# --- DRY RUN ---
+def make_fake_catalog(fakes, products, seed):
+    """Synthetic catalog: 1-4 images per product, some photos shared, a few broken links."""
+    rng = np.random.default_rng(seed)
+    bucket = fakes.FakeBucket(name="dry-run")
+    for i in range(products):
+        urls = [f"https://example.invalid/images/photo-{rng.integers(0, products * 2)}.jpg"
+                for _ in range(rng.integers(1, 5))]
+        if i % 50 == 7:
+            urls.append(f"https://example.invalid/images/product-{i}{fakes.BROKEN_IMAGE_SUFFIX}")
+        json_data = {
+            'title': f"Product {i}",
+            'internalId': f"product-{i:06d}",
+            'images': [{'uri': url} for url in urls]
+        }
+        bucket.put_json(f"json/product-{i:06d}.json", json_data)
+    catalog.write_snapshot(bucket, catalog.scan_catalog(bucket)[0])
+    return bucket
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--yes', action='store_true', help="confirm re-indexing the live index")
+    parser.add_argument('--dry-run', action='store_true', help="run against in-process fakes")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="products in flight")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--limit', type=int, help="stop after this many products")
+    parser.add_argument('--checkpoint', help=f"checkpoint file (default {DEFAULT_CHECKPOINT})")
+    parser.add_argument('--restart', action='store_true', help="ignore and clear the checkpoint")
+    parser.add_argument('--products', type=int, default=200, help="dry run: catalog size")
+    parser.add_argument('--latency-ms', type=float, default=20, help="dry run: simulated download/model latency")
+    parser.add_argument('--seed', type=int, default=0, help="dry run: catalog seed")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("BULK RE-INDEXING" + (" (DRY RUN)" if args.dry_run else ""))
+    print("="*60 + "\n")
+
+    if args.dry_run:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+        import fakes
+        bucket = make_fake_catalog(fakes, args.products, args.seed)
+        latency = args.latency_ms / 1000
+        model, index = fakes.FakeEmbeddingModel(latency), fakes.FakeMatchingEngineIndex(latency)
+        fakes.install(registry, bucket, model, None, index, fakes.FakeHttpSession(latency, image_size=(1600, 1200)))
+        # The fake catalog is rebuilt every run, so an old checkpoint would only skip it
+        checkpoint_path = args.checkpoint or os.path.join(tempfile.mkdtemp(prefix="reindex-dry-run-"), DEFAULT_CHECKPOINT)
+    else:
+        if not args.yes:
+            print("This replaces the embeddings of every product in the live index.")
+            print("Re-run with --yes to continue, or --dry-run to try it against fakes.")
+            sys.exit(2)
+        registry.configure_vertex(PROJECT_ID, LOCATION)
+        bucket = registry.storage_client().bucket(SOURCE_BUCKET)
+        model = registry.embedding_model(EMBEDDING_MODEL_NAME)
+        index = registry.matching_engine_index(INDEX_NAME)
+        checkpoint_path = args.checkpoint or DEFAULT_CHECKPOINT
+
+    reindexer = Reindexer(
+        bucket, model, index,
+        Checkpoint(checkpoint_path, restart=args.restart),
+        workers=max(1, args.workers),
+        batch_size=max(1, args.batch_size)
+    )
+    elapsed = reindexer.run(limit=args.limit)
+    reindexer.report(elapsed)
+    if args.dry_run:
+        print(f"Fake index holds {len(index.datapoints)} vectors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Catalog snapshot shared by the product functions.
+
+The snapshot is a single JSONL object: a header line followed by one line per
+product, sorted by title. Readers load it in one GCS round trip instead of
+downloading every json/*.json blob; writers patch it whenever a product JSON
+is written or deleted.
+
+Each Cloud Function deploys its own source folder, so this module is kept
+identical in findProduct/, getProduct/ and addProductEmbedding/.
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions as gcs_exceptions
+
+METADATA_PREFIX = "json/"
+SNAPSHOT_BLOB = "catalog/snapshot.jsonl"
+SNAPSHOT_FORMAT = "storagedetective-catalog"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_WRITE_RETRIES = 5
+
+# Parallel downloads for the prefix scan. The storage client's HTTP pool keeps
+# 10 connections per host, so larger values stop reusing connections.
+LOAD_WORKERS = int(os.environ.get("CATALOG_LOAD_WORKERS", "10"))
+
+
+# --- NORMALIZATION ---
+def extract_image_urls(product):
+    """Collect image URLs from the multi-image or legacy single-image schema."""
+    image_urls = []
+    if 'images' in product and isinstance(product['images'], list):
+        for img in product['images']:
+            if isinstance(img, dict):
+                url = img.get('uri', img.get('url', ''))
+                if url:
+                    image_urls.append(url)
+            elif isinstance(img, str):
+                image_urls.append(img)
+    elif 'uri' in product:
+        image_urls = [product['uri']]
+    elif 'imageUrl' in product:
+        image_urls = [product['imageUrl']]
+    return image_urls
+
+
+def normalize_product(json_data):
+    """Flatten a structData or flat product JSON into the API record shape."""
+    if 'structData' in json_data:
+        product = json_data['structData']
+        product_id = product.get('internalId') or json_data.get('id')
+    else:
+        product = json_data
+        product_id = product.get('internalId') or product.get('id')
+
+    if not product_id:
+        return None
+
+    image_urls = extract_image_urls(product)
+    return {
+        'id': product_id,
+        'title': product.get('title', 'Unknown'),
+        'catalogNumber': product.get('catalogNumber', 'N/A'),
+        'description': product.get('description', ''),
+        'imageUrl': image_urls[0] if image_urls else '',
+        'imageUrls': image_urls,
+        'categories': product.get('categories', []),
+        'available_time': product.get('available_time', '')
+    }
+
+
+def is_product_blob(name):
+    return name.startswith(METADATA_PREFIX) and name.endswith('.json')
+
+
+def make_entry(name, generation, json_data):
+    """Build a snapshot entry for one product JSON blob, or None if it has no ID."""
+    product = normalize_product(json_data)
+    if product is None:
+        return None
+    return {
+        'name': name,
+        'generation': int(generation or 0),
+        'id': product['id'],
+        'product': product
+    }
+
+
+def sort_entries(entries):
+    return sorted(entries, key=lambda e: (e['product'].get('title', '').lower(), e['id']))
+
+
+# --- PREFIX SCAN ---
+def list_generations(bucket):
+    """Map every product JSON name to its current generation (listing only)."""
+    blobs = bucket.list_blobs(
+        prefix=METADATA_PREFIX,
+        fields="items(name,generation),nextPageToken"
+    )
+    return {blob.name: int(blob.generation or 0) for blob in blobs if is_product_blob(blob.name)}
+
+
+def load_entry(bucket, name, generation=None):
+    """Download one product JSON (pinned to `generation` if given) and build its entry."""
+    blob = bucket.blob(name, generation=generation)
+    json_data = json.loads(blob.download_as_bytes())
+    entry = make_entry(name, blob.generation or generation, json_data)
+    if entry is None:
+        raise ValueError("no product ID in JSON")
+    return entry
+
+
+def load_entries(bucket, generations, max_workers=None):
+    """
+    Download product JSONs concurrently through a bounded thread pool.
+    `generations` maps blob name -> generation. Returns (entries, failures);
+    each failure is a dict with name, generation, error and whether it is
+    permanent (unparseable JSON / no product ID) rather than a transient
+    download error.
+    """
+    max_workers = max(1, max_workers or LOAD_WORKERS)
+    entries, failures = [], []
+    if not generations:
+        return entries, failures
+
+    start = time.time()
+
+    def _load(item):
+        name, generation = item
+        try:
+            return load_entry(bucket, name, generation), None
+        except Exception as e:
+            return None, {
+                'name': name,
+                'generation': generation,
+                'error': str(e),
+                'permanent': isinstance(e, ValueError)
+            }
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(generations))) as pool:
+        for entry, failure in pool.map(_load, generations.items()):
+            if failure:
+                failures.append(failure)
+            else:
+                entries.append(entry)
+
+    for failure in failures:
+        logging.warning(f"Failed to load {failure['name']}: {failure['error']}")
+    logging.info(
+        f"Loaded {len(entries)}/{len(generations)} product JSONs in "
+        f"{time.time() - start:.2f}s with {max_workers} workers ({len(failures)} failed)"
+    )
+    return entries, failures
+
+
+def scan_catalog(bucket, generations=None):
+    """
+    Download and normalize every product JSON under the metadata prefix.
+    Returns (entries, skipped) where skipped maps permanently unusable blob
+    names to their generation, so the snapshot does not look stale forever.
+    """
+    if generations is None:
+        generations = list_generations(bucket)
+    entries, failures = load_entries(bucket, generations)
+    skipped = {f['name']: f['generation'] for f in failures if f['permanent']}
+    return entries, skipped
+
+
+def iter_scanned_entries(bucket, chunk_size=None):
+    """
+    Yield entries straight from json/ in listing order, downloading
+    `chunk_size` blobs at a time through the thread pool so memory stays
+    bounded by one chunk.
+    """
+    chunk_size = chunk_size or LOAD_WORKERS * 4
+    chunk = {}
+    for name, generation in list_generations(bucket).items():
+        chunk[name] = generation
+        if len(chunk) >= chunk_size:
+            yield from load_entries(bucket, chunk)[0]
+            chunk = {}
+    if chunk:
+        yield from load_entries(bucket, chunk)[0]
+
+
+# --- SNAPSHOT I/O ---
+def read_snapshot(bucket):
+    """
+    Return (header, entries, generation) for the snapshot object.
+    header/entries are None when it is missing, corrupt or from another
+    format version; generation is 0 when the object does not exist.
+    """
+    blob = bucket.blob(SNAPSHOT_BLOB)
+    try:
+        data = blob.download_as_bytes()
+    except gcs_exceptions.NotFound:
+        return None, None, 0
+
+    generation = blob.generation
+    try:
+        lines = data.decode('utf-8').splitlines()
+        header = json.loads(lines[0])
+        entries = [json.loads(line) for line in lines[1:] if line]
+    except (ValueError, IndexError) as e:
+        logging.warning(f"Catalog snapshot is unreadable: {e}")
+        return None, None, generation
+
+    if header.get('format') != SNAPSHOT_FORMAT or header.get('version') != SNAPSHOT_VERSION:
+        logging.info(f"Catalog snapshot version {header.get('version')} is not {SNAPSHOT_VERSION}")
+        return None, None, generation
+    return header, entries, generation
+
+
+def iter_snapshot_entries(bucket):
+    """
+    Stream entries from the snapshot object line by line, already sorted by
+    title, without holding the catalog in memory. Yields nothing and returns
+    False if the snapshot is missing or from another format version.
+    """
+    try:
+        with bucket.blob(SNAPSHOT_BLOB).open('r', encoding='utf-8') as reader:
+            header = json.loads(reader.readline() or '{}')
+            if header.get('format') != SNAPSHOT_FORMAT or header.get('version') != SNAPSHOT_VERSION:
+                return False
+            for line in reader:
+                if line.strip():
+                    yield json.loads(line)
+    except gcs_exceptions.NotFound:
+        return False
+    return True
+
+
+def write_snapshot(bucket, entries, skipped=None, if_generation_match=None):
+    """Write entries as a new snapshot generation. Returns (sorted entries, new generation)."""
+    entries = sort_entries(entries)
+    header = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'updated': time.time(),
+        'count': len(entries),
+        'skipped': skipped or {}
+    }
+    lines = [json.dumps(header)] + [json.dumps(entry) for entry in entries]
+    blob = bucket.blob(SNAPSHOT_BLOB)
+    blob.upload_from_string(
+        '\n'.join(lines) + '\n',
+        content_type='application/x-ndjson',
+        if_generation_match=if_generation_match
+    )
+    return entries, blob.generation
+
+
+def diff_generations(recorded, listed):
+    """Return ({name: generation} for new/changed blobs, [names of deleted blobs])."""
+    changed = {name: gen for name, gen in listed.items() if recorded.get(name) != gen}
+    removed = [name for name in recorded if name not in listed]
+    return changed, removed
+
+
+def refresh_entries(bucket, by_name, skipped, listed=None):
+    """
+    Bring a name -> entry map up to date with the json/ prefix, downloading
+    only new or re-written blobs and evicting deleted ones.
+    Returns (by_name, skipped, number of blobs changed or removed); the input
+    dicts are not modified.
+    """
+    if listed is None:
+        listed = list_generations(bucket)
+    recorded = dict(skipped)
+    recorded.update({name: entry['generation'] for name, entry in by_name.items()})
+    changed, removed = diff_generations(recorded, listed)
+    if not changed and not removed:
+        return by_name, skipped, 0
+
+    by_name, skipped = dict(by_name), dict(skipped)
+    for name in removed:
+        by_name.pop(name, None)
+        skipped.pop(name, None)
+
+    loaded, failures = load_entries(bucket, changed)
+    for entry in loaded:
+        by_name[entry['name']] = entry
+        skipped.pop(entry['name'], None)
+    for failure in failures:
+        if failure['permanent']:
+            by_name.pop(failure['name'], None)
+            skipped[failure['name']] = failure['generation']
+
+    logging.info(f"Catalog delta: {len(changed)} new/changed, {len(removed)} removed")
+    return by_name, skipped, len(changed) + len(removed)
+
+
+def load_catalog(bucket, verify=True):
+    """
+    Load catalog entries from the snapshot, sorted by title.
+    A stale snapshot is patched by re-downloading only the changed blobs; a
+    missing one (or one from another format version) falls back to a full
+    prefix scan. Either way the snapshot is rewritten for the next reader.
+    """
+    return load_catalog_versioned(bucket, verify)[0]
+
+
+def load_catalog_versioned(bucket, verify=True):
+    """
+    Like load_catalog, but returns (entries, snapshot generation). The
+    generation is the catalog version; it is None if the snapshot could not
+    be rewritten because another writer got there first.
+    """
+    entries, _, generation = load_catalog_state(bucket, verify)
+    return entries, generation
+
+
+def load_catalog_state(bucket, verify=True):
+    """
+    Like load_catalog_versioned, but returns (entries, skipped, generation),
+    where skipped maps permanently malformed blob names to their generation
+    so that later delta refreshes do not download them again.
+    """
+    header, entries, generation = read_snapshot(bucket)
+    if entries is not None:
+        skipped = header.get('skipped', {})
+        if not verify:
+            return entries, skipped, generation
+        by_name = {entry['name']: entry for entry in entries}
+        by_name, skipped, changes = refresh_entries(bucket, by_name, skipped)
+        if not changes:
+            logging.info(f"✓ Catalog snapshot generation {generation}: {len(entries)} products")
+            return entries, skipped, generation
+        logging.info("Catalog snapshot was stale - patched from json/")
+        entries = list(by_name.values())
+    else:
+        logging.info("No usable catalog snapshot - scanning")
+        entries, skipped = scan_catalog(bucket)
+
+    try:
+        entries, generation = write_snapshot(bucket, entries, skipped, if_generation_match=generation)
+        logging.info(f"✓ Rewrote catalog snapshot with {len(entries)} products")
+    except gcs_exceptions.PreconditionFailed:
+        # Another writer refreshed it first; our result is still a valid answer.
+        entries, generation = sort_entries(entries), None
+    return entries, skipped, generation
+
+
+def update_snapshot(bucket, upserts=(), removed_names=()):
+    """
+    Patch the snapshot in place: replace/add `upserts` entries and drop blobs
+    named in `removed_names`. Uses generation preconditions so concurrent
+    writers retry instead of overwriting each other. Builds a full snapshot
+    if none exists yet.
+    """
+    upserts = [entry for entry in upserts if entry]
+    removed = set(removed_names)
+
+    for _ in range(SNAPSHOT_WRITE_RETRIES):
+        header, entries, generation = read_snapshot(bucket)
+        if entries is None:
+            load_catalog(bucket, verify=False)
+            continue
+
+        by_name = {entry['name']: entry for entry in entries}
+        skipped = dict(header.get('skipped', {}))
+        for name in removed:
+            by_name.pop(name, None)
+            skipped.pop(name, None)
+        for entry in upserts:
+            current = by_name.get(entry['name'])
+            if current and current['generation'] > entry['generation']:
+                continue
+            by_name[entry['name']] = entry
+            skipped.pop(entry['name'], None)
+
+        try:
+            write_snapshot(bucket, list(by_name.values()), skipped, if_generation_match=generation)
+            return True
+        except gcs_exceptions.PreconditionFailed:
+            logging.info("Catalog snapshot changed concurrently - retrying")
+
+    logging.warning("Gave up updating catalog snapshot after concurrent writes")
+    return False
@@ -0,0 +1,144 @@
+"""
+Concurrent image download + embedding for multi-image products.
+
+Every image of a product is downloaded and embedded in parallel on a
+process-wide bounded thread pool (shared by all requests on the instance),
+through one pooled requests.Session. A per-product deadline caps the time
+from when the pool starts on the product's first image, so time spent
+queued behind other products (bulk updates) does not count; images still
+pending when it passes are dropped and the product is embedded from the
+ones that finished. Embeddings are averaged in image order exactly as
+before (np.mean over the stacked vectors).
+
+With an EmbeddingStore, images are still downloaded but the model is only
+called for content whose SHA-256 has not been embedded before. Images are
+run through image_preprocess before they are sent to the model.
+
+Each Cloud Function deploys its own source folder, so this module is kept
+identical in getProduct/ and addProductEmbedding/.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+import embedding_store
+import image_preprocess
+import registry
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_PIPELINE_WORKERS", "8"))
+PRODUCT_DEADLINE_SECONDS = float(os.environ.get("IMAGE_PIPELINE_DEADLINE_SECONDS", "60"))
+DOWNLOAD_TIMEOUT_SECONDS = 30
+QUEUE_POLL_SECONDS = 1.0
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-pipeline")
+
+
+def download_image(url, timeout=DOWNLOAD_TIMEOUT_SECONDS):
+    response = registry.http_session(IMAGE_WORKERS).get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+def embed_image_bytes(model, image_bytes, dimension):
+    from vertexai.vision_models import Image as VertexImage  # deferred: heavy SDK import
+    image_bytes = image_preprocess.prepare_for_embedding(image_bytes)
+    start = time.perf_counter()
+    embeddings = model.get_embeddings(
+        image=VertexImage(image_bytes=image_bytes),
+        contextual_text=None,  # IMAGE ONLY
+        dimension=dimension
+    )
+    image_preprocess.record_model_call(time.perf_counter() - start, len(image_bytes))
+    return embeddings.image_embedding
+
+
+class _ProductClock:
+    """A product's deadline, started by whichever of its images the pool picks up first."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.deadline is None:
+                self.deadline = time.monotonic() + self.seconds
+            return self.deadline
+
+    def remaining(self):
+        """Seconds left, or None while none of the product's images has started."""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+
+def _embed_one(model, url, dimension, clock, timeout, store):
+    remaining = clock.start() - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("product deadline passed before download")
+    image_bytes = download_image(url, timeout=min(timeout, remaining))
+    if store is None:
+        return embed_image_bytes(model, image_bytes, dimension), False
+    digest = embedding_store.content_hash(image_bytes)
+    vector = store.get(digest)
+    if vector is not None:
+        return vector, True
+    return store.put(digest, embed_image_bytes(model, image_bytes, dimension)), False
+
+
+def embed_images(model, image_urls, dimension, deadline_seconds=PRODUCT_DEADLINE_SECONDS,
+                 timeout=DOWNLOAD_TIMEOUT_SECONDS, store=None):
+    """
+    Download and embed all `image_urls` concurrently.
+    Returns (embeddings, failures): embeddings in the original image order
+    for every image that succeeded, failures as [(index, url, error)].
+    If `store` is given, stored per-image embeddings are reused.
+    """
+    # One-time SDK import (lazy since cold-start work) stays outside the deadline
+    from vertexai.vision_models import Image  # noqa: F401
+    clock = _ProductClock(deadline_seconds)
+    futures = {
+        _executor.submit(_embed_one, model, url, dimension, clock, timeout, store): i
+        for i, url in enumerate(image_urls)
+    }
+    results = {}
+    reused = 0
+    failures = []
+    pending = set(futures)
+    while pending:
+        remaining = clock.remaining()
+        if remaining is not None and remaining <= 0:
+            break
+        # Still queued behind other work: the deadline has not started yet
+        timeout = remaining if remaining is not None else QUEUE_POLL_SECONDS
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            i = futures[future]
+            try:
+                results[i], was_stored = future.result()
+                reused += was_stored
+                logging.info(f"  ✓ {'Reused stored' if was_stored else 'Generated'} embedding for image {i+1}/{len(image_urls)}")
+            except Exception as e:
+                logging.error(f"  ✗ Failed to process image {i+1}: {e}")
+                failures.append((i, image_urls[i], str(e)))
+
+    for future in pending:
+        future.cancel()
+        i = futures[future]
+        logging.error(f"  ✗ Image {i+1} missed the {deadline_seconds:.0f}s product deadline")
+        failures.append((i, image_urls[i], "deadline exceeded"))
+
+    if reused:
+        logging.info(f"✓ Reused {reused}/{len(results)} stored image embeddings")
+    return [results[i] for i in sorted(results)], failures
+
+
+def average_embeddings(embeddings):
+    """One embedding for the product: the single vector as-is, or the element-wise mean."""
+    if len(embeddings) == 1:
+        return embeddings[0]
+    return np.mean(np.array(embeddings), axis=0).tolist()
@@ -2,15 +2,28 @@
 Complete get_products.py with multi-image support
 """
 
+import base64
+import bisect
+import gzip
 import json
 import logging
+import os
+import re
+import time
 import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 import functions_framework
-import vertexai
-from vertexai.vision_models import MultiModalEmbeddingModel, Image as VertexImage
-from google.cloud import storage, aiplatform
-import requests
-import numpy as np
+from flask import Response
+from google.api_core import exceptions as gcs_exceptions
+
+import catalog
+import embedding_store
+import image_pipeline
+import ingest_state
+import registry
+import timing
+import vector_index
 
 logging.basicConfig(level=logging.INFO)
 
@@ -21,15 +34,30 @@ METADATA_BUCKET = "storagedetective.firebasestorage.app"
 METADATA_PREFIX = "json/"
 IMAGES_PREFIX = "images/"
 EMBEDDING_DIMENSION = 512
+EMBEDDING_MODEL_NAME = "multimodalembedding@001"
 
 INDEX_ID = "8707413011381354496"
 INDEX_NAME = f"projects/{PROJECT_NUMBER}/locations/{LOCATION}/indexes/{INDEX_ID}"
 
-vertexai.init(project=PROJECT_ID, location=LOCATION)
-aiplatform.init(project=PROJECT_ID, location=LOCATION)
+# Catalog GET: how long a verified snapshot is trusted before re-listing json/,
+# page size cap, and the smallest body worth gzipping.
+CATALOG_VERIFY_SECONDS = int(os.environ.get("CATALOG_VERIFY_SECONDS", "30"))
+MAX_PAGE_LIMIT = 500
+GZIP_MIN_BYTES = 1024
+STREAM_FLUSH_LINES = 100
+
+# Bulk PUT/DELETE: products per request, concurrent GCS operations, and the
+# GCS JSON API limit of calls per batch request.
+BULK_MAX_PRODUCTS = 500
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", "10"))
+DELETE_BATCH_SIZE = 100
+
+# Vertex AI is initialized on first embedding/index call, not at cold start
+registry.configure_vertex(PROJECT_ID, LOCATION)
 
 
 @functions_framework.http
+@timing.timed_handler("get_products")
 def get_products(request):
     """HTTP Cloud Function to manage products."""
     
@@ -37,17 +65,20 @@ def get_products(request):
     headers = {
         'Access-Control-Allow-Origin': frontend_url,
         'Access-Control-Allow-Methods': 'GET, PUT, DELETE, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type',
+        'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
+        'Access-Control-Expose-Headers': 'ETag, Server-Timing',
     }
     
     if request.method == 'OPTIONS':
         return ('', 204, headers)
     
     if request.method == 'GET':
+        if timing.debug_requested(request):
+            return (json.dumps(timing.snapshot()), 200, headers)
         try:
-            logging.info("GET request - Fetching all products")
-            products = fetch_all_products()
-            return (json.dumps({"products": products}), 200, headers)
+            return get_catalog_response(request, headers)
+        except ValueError as e:
+            return (json.dumps({"error": str(e)}), 400, headers)
         except Exception as e:
             logging.error(f"Error in GET: {e}\n{traceback.format_exc()}")
             return (json.dumps({"error": str(e)}), 500, headers)
@@ -55,6 +86,12 @@ def get_products(request):
     elif request.method == 'PUT':
         try:
             request_json = request.get_json(silent=True)
+            if isinstance(request_json, dict) and isinstance(request_json.get('products'), list):
+                items = request_json['products']
+                if not items or len(items) > BULK_MAX_PRODUCTS:
+                    return (json.dumps({"error": f"Send 1-{BULK_MAX_PRODUCTS} products"}), 400, headers)
+                return (json.dumps(bulk_update(items)), 200, headers)
+            
             if not request_json or 'product' not in request_json:
                 return (json.dumps({"error": "Invalid request"}), 400, headers)
             
@@ -75,12 +112,30 @@ def get_products(request):
                 update_product_embedding(product_id, image_urls)
             
             return (json.dumps({"message": "Product updated successfully"}), 200, headers)
+        except ValueError as e:
+            return (json.dumps({"error": str(e)}), 400, headers)
         except Exception as e:
             logging.error(f"Error in PUT: {e}\n{traceback.format_exc()}")
             return (json.dumps({"error": str(e)}), 500, headers)
     
     elif request.method == 'DELETE':
         try:
+            # Bulk: {"ids": [...]} body or ?ids=a,b,c
+            request_json = request.get_json(silent=True)
+            if isinstance(request_json, dict) and 'ids' in request_json:
+                product_ids = request_json['ids']
+            elif 'ids' in request.args:
+                product_ids = [i for i in request.args['ids'].split(',') if i]
+            else:
+                product_ids = None
+            if product_ids is not None:
+                if not isinstance(product_ids, list) or not product_ids or not all(isinstance(i, str) and i for i in product_ids):
+                    return (json.dumps({"error": "ids must be a non-empty list of product IDs"}), 400, headers)
+                product_ids = list(dict.fromkeys(product_ids))
+                if len(product_ids) > BULK_MAX_PRODUCTS:
+                    return (json.dumps({"error": f"At most {BULK_MAX_PRODUCTS} products per request"}), 400, headers)
+                return (json.dumps(delete_products(product_ids)), 200, headers)
+            
             product_id = request.args.get('id')
             if not product_id:
                 return (json.dumps({"error": "Product ID required"}), 400, headers)
@@ -94,67 +149,187 @@ def get_products(request):
     return (json.dumps({"error": "Method not allowed"}), 405, headers)
 
 
+_catalog_memo = {'entries': None, 'generation': None, 'verified_at': 0.0}
+
+
+def load_catalog_entries():
+    """
+    Catalog entries (sorted by title) and the snapshot generation as version.
+    A recently verified copy is reused while the snapshot generation is
+    unchanged, which costs one metadata request instead of a download + listing.
+    """
+    bucket = registry.storage_client().bucket(METADATA_BUCKET)
+    memo = _catalog_memo
+    
+    if memo['entries'] is not None and time.time() - memo['verified_at'] < CATALOG_VERIFY_SECONDS:
+        blob = bucket.get_blob(catalog.SNAPSHOT_BLOB)
+        if blob is not None and blob.generation == memo['generation']:
+            return memo['entries'], memo['generation']
+    
+    entries, generation = catalog.load_catalog_versioned(bucket)
+    memo.update(entries=entries, generation=generation, verified_at=time.time())
+    return entries, generation
+
+
 def fetch_all_products():
-    """Fetch all products with multi-image support."""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(METADATA_BUCKET)
-    blobs = bucket.list_blobs(prefix=METADATA_PREFIX)
+    """Fetch all products (sorted by title) from the catalog snapshot."""
+    entries, _ = load_catalog_entries()
+    return [entry['product'] for entry in entries]
+
+
+def catalog_stats(entries):
+    return {
+        "totalProducts": len(entries),
+        "totalImages": sum(len(entry['product'].get('imageUrls', [])) for entry in entries)
+    }
+
+
+def sort_key(entry):
+    return (entry['product'].get('title', '').lower(), entry['id'])
+
+
+def encode_page_cursor(entry):
+    return base64.urlsafe_b64encode(json.dumps(list(sort_key(entry))).encode()).decode()
+
+
+def decode_page_cursor(cursor):
+    try:
+        title, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (str(title), str(product_id))
+    except Exception:
+        raise ValueError("Malformed cursor")
+
+
+def int_arg(args, name, default=None):
+    """Integer query parameter; raises ValueError (400) for a malformed value."""
+    value = args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Malformed {name}: must be an integer")
+
+
+def get_catalog_response(request, headers):
+    """
+    GET /get_products with optional parameters:
+      view=stats        - counts only
+      fields=id,title   - project each product onto these keys
+      limit=N           - page size (max MAX_PAGE_LIMIT); with page=P (1-based)
+                          or cursor=<next_cursor> for keyset paging that is
+                          stable while products are added or removed
+      format=ndjson     - stream newline-delimited products (see stream_catalog_response)
+    Without parameters the whole catalog is returned as before. Responses
+    carry a weak ETag of the catalog version (304 on If-None-Match) and are
+    gzipped when the client accepts it.
+    """
+    args = request.args
+    if args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        return stream_catalog_response(request, headers)
     
-    products = []
+    with timing.span("catalog"):
+        entries, generation = load_catalog_entries()
     
-    for blob in blobs:
-        if not blob.name.endswith('.json'):
-            continue
-            
-        try:
-            json_string = blob.download_as_string()
-            json_data = json.loads(json_string)
-            
-            if 'structData' in json_data:
-                product = json_data['structData']
-                product['id'] = product.get('internalId') or json_data.get('id')
+    if generation is not None:
+        etag = f'W/"catalog-{generation}"'
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'no-cache'
+        if etag in request.headers.get('If-None-Match', ''):
+            return ('', 304, headers)
+    
+    if args.get('view') == 'stats':
+        payload = {"stats": catalog_stats(entries)}
+    else:
+        payload = {}
+        limit = int_arg(args, 'limit')
+        if limit is not None:
+            limit = max(1, min(limit, MAX_PAGE_LIMIT))
+            if args.get('cursor'):
+                start = bisect.bisect_right([sort_key(e) for e in entries], decode_page_cursor(args['cursor']))
             else:
-                product = json_data
-                if 'internalId' not in product and 'id' in json_data:
-                    product['id'] = json_data['id']
-            
-            # Extract ALL image URLs
-            image_urls = []
-            if 'images' in product and isinstance(product['images'], list):
-                for img in product['images']:
-                    if isinstance(img, dict):
-                        url = img.get('uri', img.get('url', ''))
-                        if url:
-                            image_urls.append(url)
-                    elif isinstance(img, str):
-                        image_urls.append(img)
-            elif 'uri' in product:
-                image_urls.append(product['uri'])
-            elif 'imageUrl' in product:
-                image_urls.append(product['imageUrl'])
-            
-            products.append({
-                'id': product.get('id', product.get('internalId')),
-                'title': product.get('title', 'Unknown'),
-				'catalogNumber': product.get('catalogNumber', 'N/A'),
-                'description': product.get('description', ''),
-				'imageUrl': image_urls[0] if image_urls else '',
-                'imageUrls': image_urls,
-                'categories': product.get('categories', []),
-                'available_time': product.get('available_time', '')
+                start = (max(1, int_arg(args, 'page', 1)) - 1) * limit
+            page_entries = entries[start:start + limit]
+            has_more = start + limit < len(entries)
+            payload.update({
+                "total": len(entries),
+                "has_more": has_more,
+                "next_cursor": encode_page_cursor(page_entries[-1]) if has_more and page_entries else None
             })
-            
-        except Exception as e:
-            logging.warning(f"Failed to load {blob.name}: {e}")
+        else:
+            page_entries = entries
+        
+        products = [entry['product'] for entry in page_entries]
+        fields = [f.strip() for f in args.get('fields', '').split(',') if f.strip()]
+        if fields:
+            products = [{key: product.get(key) for key in fields} for product in products]
+        payload["products"] = products
     
-    products.sort(key=lambda x: x.get('title', '').lower())
-    return products
+    with timing.span("serialize"):
+        body = json.dumps(payload)
+    if 'gzip' in request.headers.get('Accept-Encoding', '') and len(body) >= GZIP_MIN_BYTES:
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+        with timing.span("gzip"):
+            compressed = gzip.compress(body.encode('utf-8'), compresslevel=5)
+        return (compressed, 200, headers)
+    return (body, 200, headers)
 
 
-def update_product(product_id, updated_data):
-    """Update product with multi-image support."""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(METADATA_BUCKET)
+
+def stream_catalog_response(request, headers):
+    """
+    Stream the catalog as NDJSON, one product per line, while it is read.
+    Default order is by title, streamed line by line from the pre-sorted
+    snapshot; order=none (or a missing snapshot) streams json/ in listing
+    order through the bounded download pool. fields= projection applies.
+    Memory stays bounded by one line / one download chunk.
+    """
+    args = request.args
+    bucket = registry.storage_client().bucket(METADATA_BUCKET)
+    fields = [f.strip() for f in args.get('fields', '').split(',') if f.strip()]
+    sorted_order = args.get('order', 'title') != 'none'
+    
+    def _entries():
+        if sorted_order:
+            found = yield from catalog.iter_snapshot_entries(bucket)
+            if found:
+                return
+            logging.info("No usable catalog snapshot - streaming json/ unsorted")
+        yield from catalog.iter_scanned_entries(bucket)
+    
+    def _lines():
+        for entry in _entries():
+            product = entry['product']
+            if fields:
+                product = {key: product.get(key) for key in fields}
+            yield json.dumps(product) + '\n'
+    
+    stream_headers = dict(headers)
+    stream_headers['Content-Type'] = 'application/x-ndjson'
+    body = _lines()
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        stream_headers['Content-Encoding'] = 'gzip'
+        stream_headers['Vary'] = 'Accept-Encoding'
+        body = gzip_stream(body)
+    return Response(body, status=200, headers=stream_headers)
+
+
+def gzip_stream(lines):
+    """Gzip a line iterator, sync-flushing every STREAM_FLUSH_LINES so clients can render early."""
+    compressor = zlib.compressobj(5, zlib.DEFLATED, 31)
+    for count, line in enumerate(lines, 1):
+        chunk = compressor.compress(line.encode('utf-8'))
+        if count % STREAM_FLUSH_LINES == 0:
+            chunk += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+# --- UPDATES ---
+def write_product_json(bucket, product_id, updated_data):
+    """Merge an edit into the product JSON and write it. Returns the new catalog entry."""
     blob = bucket.blob(f"{METADATA_PREFIX}{product_id}.json")
     
     if blob.exists():
@@ -167,9 +342,8 @@ def update_product(product_id, updated_data):
     struct_data['internalId'] = product_id
     struct_data['title'] = updated_data.get('title', struct_data.get('title', ''))
     struct_data['description'] = updated_data.get('description', struct_data.get('description', ''))
-    struct_data['structData']['catalogNumber'] = product_data.get('catalogNumber', 'N/A')
-
-     
+    struct_data['catalogNumber'] = updated_data.get('catalogNumber', struct_data.get('catalogNumber', 'N/A'))
+    
     # Update images array
     if 'imageUrls' in updated_data:
         struct_data['images'] = [{'uri': url} for url in updated_data['imageUrls']]
@@ -184,101 +358,255 @@ def update_product(product_id, updated_data):
     
     blob.upload_from_string(json.dumps(existing_data, indent=2), content_type='application/json')
     logging.info(f"✓ Updated: {product_id}")
+    return catalog.make_entry(blob.name, blob.generation, existing_data)
 
 
-def update_product_embedding(product_id, image_urls):
-    """Regenerate AVERAGED embedding from ALL images."""
-    try:
-        if not image_urls:
-            logging.warning(f"No images for {product_id}")
-            return
-        
-        logging.info(f"Generating embeddings for {len(image_urls)} image(s)")
-        
-        model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
-        all_embeddings = []
-        
-        for i, image_url in enumerate(image_urls):
-            try:
-                logging.info(f"  Processing image {i+1}/{len(image_urls)}")
-                response = requests.get(image_url, timeout=30)
-                response.raise_for_status()
-                image_bytes = response.content
-                
-                image = VertexImage(image_bytes=image_bytes)
-                embeddings = model.get_embeddings(
-                    image=image,
-                    contextual_text=None,
-                    dimension=EMBEDDING_DIMENSION
-                )
-                
-                all_embeddings.append(embeddings.image_embedding)
-                logging.info(f"  ✓ Generated embedding {i+1}")
-            except Exception as e:
-                logging.error(f"  ✗ Failed image {i+1}: {e}")
-        
+def update_products(updates):
+    """
+    Write several product edits ([(product_id, data)]) concurrently, then
+    patch the catalog snapshot once. Returns {product_id: error or None}.
+    """
+    bucket = registry.storage_client().bucket(METADATA_BUCKET)
+    errors = {}
+    entries = []
+    
+    def _write(update):
+        product_id, updated_data = update
+        try:
+            return product_id, write_product_json(bucket, product_id, updated_data), None
+        except Exception as e:
+            logging.error(f"✗ Update failed for {product_id}: {e}")
+            return product_id, None, str(e)
+    
+    with timing.span("write_json"), ThreadPoolExecutor(max_workers=max(1, min(BULK_WORKERS, len(updates)))) as pool:
+        for product_id, entry, error in pool.map(_write, updates):
+            errors[product_id] = error
+            if entry is not None:
+                entries.append(entry)
+    
+    # Patch the snapshot now so the next catalog GET sees the edits
+    if entries:
+        try:
+            with timing.span("snapshot"):
+                catalog.update_snapshot(bucket, upserts=entries)
+        except Exception as e:
+            logging.warning(f"⚠ Catalog snapshot update failed: {e}")
+    return errors
+
+
+def update_product(product_id, updated_data):
+    """Update product with multi-image support."""
+    error = update_products([(product_id, updated_data)])[product_id]
+    if error:
+        raise Exception(error)
+
+
+def update_product_embeddings(image_urls_by_id):
+    """
+    Regenerate the AVERAGED embedding of several products concurrently, then
+    send them to the index in one upsert_datapoints call and patch the
+    persisted vector index once. Returns {product_id: error or None}.
+    """
+    bucket = registry.storage_client().bucket(METADATA_BUCKET)
+    model = registry.embedding_model(EMBEDDING_MODEL_NAME)
+    store = embedding_store.shared_store(bucket, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION)
+    errors = {}
+    vectors = {}
+    indexed_urls = {}
+    
+    def _embed(item):
+        product_id, image_urls = item
+        logging.info(f"Generating embeddings for {len(image_urls)} image(s) of {product_id}")
+        # Only images whose content is new are sent to the model
+        all_embeddings, failures = image_pipeline.embed_images(model, image_urls, EMBEDDING_DIMENSION, store=store)
         if not all_embeddings:
             raise Exception("No embeddings generated")
-        
-        # Average embeddings
         if len(all_embeddings) > 1:
-            embedding_array = np.array(all_embeddings)
-            final_embedding = np.mean(embedding_array, axis=0).tolist()
-            logging.info(f"✓ Averaged {len(all_embeddings)} embeddings")
-        else:
-            final_embedding = all_embeddings[0]
-        
-        # Update index
-        my_index = aiplatform.MatchingEngineIndex(index_name=INDEX_NAME)
-        my_index.upsert_datapoints(datapoints=[{
-            "datapoint_id": product_id,
-            "feature_vector": final_embedding
-        }])
-        
-        logging.info(f"✓✓✓ Updated embedding in index: {product_id}")
-        
+            logging.info(f"✓ Averaged {len(all_embeddings)} embeddings for {product_id}")
+        return image_pipeline.average_embeddings(all_embeddings), ingest_state.embedded_uris(image_urls, failures)
+    
+    items = list(image_urls_by_id.items())
+    with timing.span("embedding"), ThreadPoolExecutor(max_workers=max(1, min(BULK_WORKERS, len(items)))) as pool:
+        futures = {product_id: pool.submit(_embed, (product_id, urls)) for product_id, urls in items}
+        for product_id, future in futures.items():
+            try:
+                vectors[product_id], indexed_urls[product_id] = future.result()
+                errors[product_id] = None
+            except Exception as e:
+                logging.error(f"Failed to update embedding of {product_id}: {e}")
+                errors[product_id] = str(e)
+    
+    if not vectors:
+        return errors
+    
+    # Update index
+    try:
+        my_index = registry.matching_engine_index(INDEX_NAME)
+        with timing.span("index_upsert"):
+            my_index.upsert_datapoints(datapoints=[
+                {"datapoint_id": product_id, "feature_vector": vector}
+                for product_id, vector in vectors.items()
+            ])
+        logging.info(f"✓✓✓ Updated {len(vectors)} embedding(s) in index")
     except Exception as e:
-        logging.error(f"Failed to update embedding: {e}")
-        raise
+        logging.error(f"Failed to update embeddings in index: {e}")
+        errors.update({product_id: str(e) for product_id in vectors})
+        return errors
+    
+    try:
+        with timing.span("vector_index"):
+            vector_index.update_persisted_index(bucket, upserts=vectors)
+    except Exception as e:
+        logging.warning(f"⚠ Local vector index update failed: {e}")
+    
+    # Lets add_product_embedding skip the JSON rewrite event for these images.
+    # Partially embedded products record only the images that made it in, so
+    # that event retries the rest.
+    with timing.span("index_state"):
+        for product_id in vectors:
+            ingest_state.write_marker(
+                bucket, product_id,
+                ingest_state.fingerprint(indexed_urls[product_id], EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION)
+            )
+    return errors
 
 
-def delete_product(product_id):
-    """Delete product and ALL its images."""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(METADATA_BUCKET)
+def update_product_embedding(product_id, image_urls):
+    """Regenerate AVERAGED embedding from ALL images."""
+    if not image_urls:
+        logging.warning(f"No images for {product_id}")
+        return
+    
+    error = update_product_embeddings({product_id: image_urls})[product_id]
+    if error:
+        raise Exception(error)
+
+
+def bulk_update(items):
+    """
+    PUT {"products": [{"product": {...}, "imagesChanged": bool}, ...]}:
+    JSON writes run concurrently, and every changed embedding goes to the
+    index in one upsert. Returns {"updated": n, "errors": {product_id: error}}.
+    """
+    updates = []
+    reembed = {}
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('product'), dict):
+            raise ValueError("Every item needs a product object")
+        product_data = item['product']
+        product_id = product_data.get('id')
+        if not product_id:
+            raise ValueError("Every product needs an id")
+        updates.append((product_id, product_data))
+        if item.get('imagesChanged') and product_data.get('imageUrls'):
+            reembed[product_id] = product_data['imageUrls']
+    
+    logging.info(f"Bulk update: {len(updates)} product(s), {len(reembed)} with changed images")
+    errors = update_products(updates)
     
-    logging.info(f"Deleting: {product_id}")
+    reembed = {product_id: urls for product_id, urls in reembed.items() if not errors.get(product_id)}
+    if reembed:
+        errors.update({
+            product_id: error
+            for product_id, error in update_product_embeddings(reembed).items() if error
+        })
+    
+    failed = {product_id: error for product_id, error in errors.items() if error}
+    return {"updated": len(updates) - len(failed), "errors": failed}
+
+
+# --- DELETION ---
+def product_object_names(bucket, product_id):
+    """
+    Names of the product's JSON and index-state marker (if present) and
+    images. Images are listed under the product's own prefix
+    (images/<id>_<n>.jpg, legacy images/<id>.jpg) rather than scanning all of images/.
+    """
+    names = [
+        name for name in (f"{METADATA_PREFIX}{product_id}.json", ingest_state.marker_name(product_id))
+        if bucket.get_blob(name) is not None
+    ]
+    
+    image_pattern = re.compile(rf"{re.escape(IMAGES_PREFIX + product_id)}(_\d+)?\.\w+")
+    blobs = bucket.list_blobs(prefix=f"{IMAGES_PREFIX}{product_id}", fields="items(name),nextPageToken")
+    names += [blob.name for blob in blobs if image_pattern.fullmatch(blob.name)]
+    return names
+
+
+def delete_blobs(bucket, names):
+    """Delete objects in GCS batch requests of DELETE_BATCH_SIZE. Returns the number deleted."""
+    storage_client = registry.storage_client()
+    deleted = 0
+    for start in range(0, len(names), DELETE_BATCH_SIZE):
+        chunk = names[start:start + DELETE_BATCH_SIZE]
+        try:
+            with storage_client.batch():
+                for name in chunk:
+                    bucket.blob(name).delete()
+            deleted += len(chunk)
+        except Exception as e:
+            # Part of the batch may have gone through; settle the rest one by one
+            logging.warning(f"⚠ Batched delete failed ({e}) - retrying {len(chunk)} object(s) individually")
+            for name in chunk:
+                try:
+                    bucket.blob(name).delete()
+                    deleted += 1
+                except gcs_exceptions.NotFound:
+                    deleted += 1
+                except Exception as e:
+                    logging.warning(f"⚠ Deletion of {name} failed: {e}")
+    return deleted
+
+
+def delete_products(product_ids):
+    """
+    Delete products and ALL their images: one remove_datapoints call, one
+    persisted-index and snapshot patch, concurrent per-product listings and
+    batched object deletes.
+    """
+    bucket = registry.storage_client().bucket(METADATA_BUCKET)
+    
+    logging.info(f"Deleting {len(product_ids)} product(s)")
     
     # Remove from index
     try:
-        my_index = aiplatform.MatchingEngineIndex(index_name=INDEX_NAME)
-        my_index.remove_datapoints(datapoint_ids=[product_id])
-        logging.info(f"✓ Removed from index")
+        my_index = registry.matching_engine_index(INDEX_NAME)
+        with timing.span("index_remove"):
+            my_index.remove_datapoints(datapoint_ids=list(product_ids))
+        logging.info(f"✓ Removed {len(product_ids)} datapoint(s) from index")
     except Exception as e:
         logging.warning(f"⚠ Index removal failed: {e}")
     
-    # Delete JSON
     try:
-        json_blob = bucket.blob(f"{METADATA_PREFIX}{product_id}.json")
-        if json_blob.exists():
-            json_blob.delete()
-            logging.info(f"✓ Deleted JSON")
+        with timing.span("vector_index"):
+            vector_index.update_persisted_index(bucket, removals=product_ids)
     except Exception as e:
-        logging.warning(f"⚠ JSON deletion failed: {e}")
+        logging.warning(f"⚠ Local vector index update failed: {e}")
+    
+    def _names(product_id):
+        try:
+            return product_object_names(bucket, product_id)
+        except Exception as e:
+            logging.warning(f"⚠ Listing objects of {product_id} failed: {e}")
+            return []
+    
+    with timing.span("list_objects"), ThreadPoolExecutor(max_workers=max(1, min(BULK_WORKERS, len(product_ids)))) as pool:
+        names = [name for product_names in pool.map(_names, product_ids) for name in product_names]
+    
+    with timing.span("delete_objects"):
+        deleted = delete_blobs(bucket, names)
+    logging.info(f"✓ Deleted {deleted}/{len(names)} object(s) (JSON + images)")
     
-    # Delete ALL images (pattern: productId_0.jpg, productId_1.jpg, etc.)
     try:
-        all_blobs = bucket.list_blobs(prefix=IMAGES_PREFIX)
-        deleted_count = 0
-        for blob in all_blobs:
-            if blob.name.startswith(f"{IMAGES_PREFIX}{product_id}_") or blob.name == f"{IMAGES_PREFIX}{product_id}.jpg":
-                blob.delete()
-                deleted_count += 1
-                logging.info(f"✓ Deleted image: {blob.name}")
-        
-        if deleted_count > 0:
-            logging.info(f"✓ Deleted {deleted_count} image(s)")
+        with timing.span("snapshot"):
+            catalog.update_snapshot(bucket, removed_names=[f"{METADATA_PREFIX}{pid}.json" for pid in product_ids])
     except Exception as e:
-        logging.warning(f"⚠ Image deletion failed: {e}")
+        logging.warning(f"⚠ Catalog snapshot update failed: {e}")
     
-    logging.info(f"✓✓✓ Deletion complete: {product_id}")
+    logging.info(f"✓✓✓ Deletion complete: {len(product_ids)} product(s)")
+    return {"deleted": len(product_ids), "objects_deleted": deleted}
+
+
+def delete_product(product_id):
+    """Delete product and ALL its images."""
+    return delete_products([product_id])
@@ -116,6 +116,7 @@ const translations = {
       searching: 'Searching...',
       results: 'Search Results',
       searchMode: 'Search mode',
+      loadMore: 'Load more',
       backToHome: 'Back to Home'
     },
     catalog: {
@@ -312,6 +313,7 @@ const translations = {
       searching: '...מחפש',
       results: 'תוצאות חיפוש',
       searchMode: 'מצב חיפוש',
+      loadMore: 'טען עוד',
       backToHome: 'חזרה לדף הבית'
     },
     catalog: {
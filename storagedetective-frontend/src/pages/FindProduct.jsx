@@ -2,6 +2,15 @@ import React, { useState } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { useLanguage } from '../context/LanguageContext';
 
+const FIND_PRODUCT_URL = "https://storage-detective-find-product-agent-325488595361.us-west1.run.app/find_product";
+const PAGE_SIZE = 20;
+
+const postFindProduct = (payload) => fetch(FIND_PRODUCT_URL, {
+  method: 'POST',
+  headers: { 'Content-Type': 'application/json' },
+  body: JSON.stringify(payload),
+});
+
 const toBase64 = file => new Promise((resolve, reject) => {
     const reader = new FileReader();
     reader.readAsDataURL(file);
@@ -19,6 +28,11 @@ function FindProduct() {
   const [message, setMessage] = useState('');
   const [searchInfo, setSearchInfo] = useState(null);
   const [expandedImageGallery, setExpandedImageGallery] = useState(null);
+  // Next-page cursor, plus the original search to re-run if the cursor expired
+  // (result lists live in one backend instance's memory)
+  const [cursor, setCursor] = useState(null);
+  const [lastPayload, setLastPayload] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const navigate = useNavigate();
 
   const handleImageChange = (e) => {
@@ -29,6 +43,7 @@ function FindProduct() {
       setResults([]);
       setMessage('');
       setSearchInfo(null);
+      setCursor(null);
     }
   };
 
@@ -41,11 +56,12 @@ function FindProduct() {
     setLoading(true);
     setMessage(t('find.searching'));
     setResults([]);
+    setCursor(null);
 
     try {
       let payload = { 
         text_query: textQuery,
-        num_results: 20,
+        num_results: PAGE_SIZE,
         offset: 0
       };
       
@@ -53,17 +69,14 @@ function FindProduct() {
         payload.image_base64 = await toBase64(imageFile);
       }
       
-      const baseUrl = "https://storage-detective-find-product-agent-325488595361.us-west1.run.app";
-      const response = await fetch(`${baseUrl}/find_product`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload),
-      });
+      const response = await postFindProduct(payload);
       
       const data = await response.json();
       if (!response.ok) throw new Error(data.message || 'Search failed');
       
       setResults(data.results);
+      setCursor(data.cursor || null);
+      setLastPayload(payload);
       setSearchInfo({
         totalMatches: data.total_matches,
         searchMode: data.search_mode
@@ -78,6 +91,30 @@ function FindProduct() {
     }
   };
 
+  const loadMore = async () => {
+    if (!cursor || loadingMore) return;
+    setLoadingMore(true);
+
+    try {
+      let response = await postFindProduct({ cursor, num_results: PAGE_SIZE });
+      if (response.status === 410) {
+        // Cursor expired or served by another instance: re-run the search from this offset
+        response = await postFindProduct({ ...lastPayload, offset: results.length });
+      }
+      
+      const data = await response.json();
+      if (!response.ok) throw new Error(data.message || 'Search failed');
+      
+      setResults(prev => [...prev, ...data.results]);
+      setCursor(data.cursor || null);
+      
+    } catch (error) {
+      setMessage(`${t('common.error')}: ${error.message}`);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const getQualityBadge = (quality) => {
     const badges = {
       'excellent': 'bg-green-500 text-white',
@@ -291,6 +328,16 @@ function FindProduct() {
               </div>
             ))}
           </div>
+
+          {cursor && (
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="mt-6 w-full py-3 px-4 bg-gray-100 text-gray-800 rounded-md hover:bg-gray-200 disabled:bg-gray-300 transition font-medium"
+            >
+              {loadingMore ? t('find.searching') : t('find.loadMore')}
+            </button>
+          )}
         </div>
       )}
 
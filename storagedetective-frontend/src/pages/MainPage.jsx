@@ -18,16 +18,13 @@ function MainPage() {
 
   const fetchStats = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/get_products`);
+      const response = await fetch(`${API_BASE_URL}/get_products?view=stats`);
       const data = await response.json();
-      const products = data.products || [];
-      const totalImages = products.reduce((sum, product) => {
-        return sum + (product.imageUrls?.length || 0);
-      }, 0);
+      const stats = data.stats || {};
 
       setStats({
-        totalProducts: products.length,
-        totalImages: totalImages,
+        totalProducts: stats.totalProducts || 0,
+        totalImages: stats.totalImages || 0,
         loading: false
       });
     } catch (error) {